@@ -1,9 +1,16 @@
+import threading
+
+
 def Singleton(cls):
     instances = {}
+    lock = threading.Lock()
 
     def wrapper(*args, **kwargs):
         if cls not in instances:
-            instances[cls] = cls(*args, **kwargs)
+            # 双重检查，多个线程同时第一次创建时只会构造一次
+            with lock:
+                if cls not in instances:
+                    instances[cls] = cls(*args, **kwargs)
         return instances[cls]
 
     return wrapper
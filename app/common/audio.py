@@ -1,3 +1,5 @@
+import io
+import wave
 from pathlib import Path
 
 import ffmpeg
@@ -6,6 +8,7 @@ from loguru import logger
 import av
 from av.audio.resampler import AudioResampler
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
 
 def reSize(input_file, hz=32000, suffix='wav'):
@@ -24,37 +27,412 @@ def reSize(input_file, hz=32000, suffix='wav'):
     return input_file
 
 
-def load_audio(file: str, sr: int) -> np.ndarray:
-    if not Path(file).exists():
+def load_audio(file, sr: int) -> np.ndarray:
+    """ 用PyAV一次完成解码和重采样到sr单声道，file可以是路径或文件对象，不产生临时文件 """
+    if isinstance(file, (str, Path)) and not Path(file).exists():
         raise FileNotFoundError(f"File not found: {file}")
-    file = reSize(file, hz=sr)
     try:
-        container = av.open(file)
-        resampler = AudioResampler(format="fltp", layout="mono", rate=sr)
-
-        # Estimated maximum total number of samples to pre-allocate the array
-        # AV stores length in microseconds by default
-        estimated_total_samples = int(container.duration * sr // 1_000_000)
-        decoded_audio = np.zeros(estimated_total_samples + 1, dtype=np.float32)
-
-        offset = 0
-        for frame in container.decode(audio=0):
-            frame.pts = None  # Clear presentation timestamp to avoid resampling issues
-            resampled_frames = resampler.resample(frame)
-            for resampled_frame in resampled_frames:
-                frame_data = resampled_frame.to_ndarray()[0]
-                end_index = offset + len(frame_data)
-
-                # Check if decoded_audio has enough space, and resize if necessary
-                if end_index > decoded_audio.shape[0]:
-                    decoded_audio = np.resize(decoded_audio, end_index + 1)
-
-                decoded_audio[offset:end_index] = frame_data
-                offset += len(frame_data)
-
-        # Truncate the array to the actual size
-        decoded_audio = decoded_audio[:offset]
+        with av.open(file) as container:
+            resampler = AudioResampler(format="fltp", layout="mono", rate=sr)
+            chunks = []
+            for frame in container.decode(audio=0):
+                frame.pts = None  # Clear presentation timestamp to avoid resampling issues
+                for resampled_frame in resampler.resample(frame):
+                    chunks.append(resampled_frame.to_ndarray()[0])
+            # 取出重采样器里剩余的样本
+            for resampled_frame in resampler.resample(None):
+                chunks.append(resampled_frame.to_ndarray()[0])
     except Exception as e:
         raise RuntimeError(f"Failed to load audio: {e}")
 
-    return decoded_audio
+    return np.concatenate(chunks).astype(np.float32) if chunks else np.zeros(0, dtype=np.float32)
+
+
+def to_pcm16(wav: np.ndarray) -> bytes:
+    """ float波形转16bit小端PCM """
+    return (np.clip(np.asarray(wav, dtype=np.float32).reshape(-1), -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+
+def save_wav(file, wav: np.ndarray, sr: int):
+    """ 把float波形写成16bit单声道wav，file可以是路径或文件对象 """
+    with wave.open(file, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sr)
+        f.writeframes(to_pcm16(wav))
+    return file
+
+
+def encode_wav(wav: np.ndarray, sr: int) -> bytes:
+    """ 在内存中编码wav，不产生临时文件 """
+    buffer = io.BytesIO()
+    save_wav(buffer, wav, sr)
+    return buffer.getvalue()
+
+
+def resample(wav: np.ndarray, length: int) -> np.ndarray:
+    """ FFT带限重采样到length个样本，整段一次完成，降采样时不会混叠 """
+    wav = np.asarray(wav, dtype=np.float32).reshape(-1)
+    if length == len(wav) or len(wav) == 0 or length <= 0:
+        return wav
+    spectrum = np.fft.rfft(wav)
+    bins = length // 2 + 1
+    if bins <= len(spectrum):
+        spectrum = spectrum[:bins]
+    else:
+        spectrum = np.pad(spectrum, (0, bins - len(spectrum)))
+    return (np.fft.irfft(spectrum, length) * (length / len(wav))).astype(np.float32)
+
+
+def _best_offset(padded, energy, template, start, count, step) -> int:
+    """ 从start开始每隔step取一个候选帧，返回归一化互相关最大的候选序号 """
+    n = len(template)
+    candidates = sliding_window_view(padded[start:start + (count - 1) * step + n], n)[::step]
+    ends = np.arange(start, start + count * step, step)
+    norm = np.sqrt(energy[ends + n] - energy[ends]) + 1e-6
+    return int(np.argmax((candidates @ template) / norm))
+
+
+def time_stretch(wav: np.ndarray, rate: float, sr: int = 24000) -> np.ndarray:
+    """
+    WSOLA变速不变调，rate>1变快。40ms汉宁窗50%重叠，每帧在±10ms内找和上一帧自然延续最相似的位置，
+    相似度用整帧的矩阵乘法一次算完所有候选位置。
+    """
+    wav = np.asarray(wav, dtype=np.float32).reshape(-1)
+    if abs(rate - 1.0) < 1e-3 or len(wav) == 0:
+        return wav
+    n = max(int(sr * 0.04) // 2 * 2, 64)
+    hop = n // 2
+    tol = max(int(sr * 0.01), 1)
+    step = 4
+    # 周期汉宁窗在50%重叠时叠加恒为1
+    window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(n) / n)).astype(np.float32)
+    out_len = int(len(wav) / rate)
+    frames = out_len // hop + 1
+    padded = np.pad(wav, (tol, int(frames * hop * rate) + 2 * n + tol))
+    energy = np.concatenate(([0.0], np.cumsum(padded.astype(np.float64) ** 2)))
+    out = np.zeros(frames * hop + n, dtype=np.float32)
+    prev = tol
+    for k in range(frames):
+        ideal = int(k * hop * rate) + tol
+        if k == 0:
+            pos = ideal
+        else:
+            template = padded[prev + hop:prev + hop + n]
+            # 先每隔step个位置粗搜，再在最好位置附近逐点细搜
+            start = ideal - tol
+            pos = start + step * _best_offset(padded, energy, template, start, 2 * tol // step + 1, step)
+            fine = max(pos - step + 1, start)
+            pos = fine + _best_offset(padded, energy, template, fine, 2 * step - 1, 1)
+        out[k * hop:k * hop + n] += padded[pos:pos + n] * window
+        prev = pos
+    return out[:out_len]
+
+
+def change_speed_pitch(wav: np.ndarray, sr: int, speed: float = 1.0, pitch: float = 1.0) -> np.ndarray:
+    """ 变速和变调：按speed/pitch做一次WSOLA，再重采样pitch倍，时长只和speed有关 """
+    speed = min(max(float(speed or 1.0), 0.25), 4.0)
+    pitch = min(max(float(pitch or 1.0), 0.5), 2.0)
+    if abs(pitch - 1.0) < 1e-3:
+        return time_stretch(wav, speed, sr)
+    stretched = time_stretch(wav, speed / pitch, sr)
+    return resample(stretched, int(round(len(stretched) / pitch)))
+
+
+def _frame_rms_db(wav: np.ndarray, frame: int) -> np.ndarray:
+    n = len(wav) // frame
+    frames = wav[:n * frame].reshape(n, frame).astype(np.float64)
+    return 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-12)
+
+
+def strip_silence(wav: np.ndarray, sr: int, threshold_db: float = -40, keep: float = 0.15,
+                  start: bool = True, end: bool = True) -> np.ndarray:
+    """ 按10ms帧RMS去掉首尾静音，低于最响帧threshold_db的算静音，留keep秒；start/end控制处理哪一头 """
+    wav = np.asarray(wav, dtype=np.float32).reshape(-1)
+    frame = max(int(sr * 0.01), 1)
+    if len(wav) < frame or not (start or end):
+        return wav
+    db = _frame_rms_db(wav, frame)
+    voiced = np.flatnonzero(db > max(db.max() + threshold_db, -80))
+    if not voiced.size:
+        return wav
+    pad = int(keep * sr)
+    return wav[max(voiced[0] * frame - pad, 0) if start else 0:
+               min((voiced[-1] + 1) * frame + pad, len(wav)) if end else len(wav)]
+
+
+def _biquad_power(b, a, w: np.ndarray) -> np.ndarray:
+    z = np.exp(-1j * w)
+    return np.abs((b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)) ** 2
+
+
+def _k_weighting(sr: int, w: np.ndarray) -> np.ndarray:
+    """ BS.1770的K加权（1500Hz +4dB高架 + 38Hz高通）在频点w上的功率增益，按采样率重新设计系数 """
+    w0 = 2 * np.pi * 1500 / sr
+    A = 10 ** (4.0 / 40)
+    alpha = np.sin(w0) / (2 / np.sqrt(2))
+    cos, sq = np.cos(w0), 2 * np.sqrt(A) * alpha
+    shelf = _biquad_power(
+        (A * ((A + 1) + (A - 1) * cos + sq), -2 * A * ((A - 1) + (A + 1) * cos), A * ((A + 1) + (A - 1) * cos - sq)),
+        ((A + 1) - (A - 1) * cos + sq, 2 * ((A - 1) - (A + 1) * cos), (A + 1) - (A - 1) * cos - sq), w)
+    w0 = 2 * np.pi * 38 / sr
+    alpha, cos = np.sin(w0) / (2 * 0.5), np.cos(w0)
+    highpass = _biquad_power(((1 + cos) / 2, -(1 + cos), (1 + cos) / 2), (1 + alpha, -2 * cos, 1 - alpha), w)
+    return shelf * highpass
+
+
+def _block_powers(wav: np.ndarray, sr: int) -> np.ndarray:
+    """ K加权在频域整段做，400ms块75%重叠，块能量用累加和一次算出 """
+    w = 2 * np.pi * np.arange(len(wav) // 2 + 1) / len(wav)
+    weighted = np.fft.irfft(np.fft.rfft(wav) * np.sqrt(_k_weighting(sr, w)), len(wav))
+    energy = np.concatenate(([0.0], np.cumsum(weighted.astype(np.float64) ** 2)))
+    block, step = int(sr * 0.4), int(sr * 0.1)
+    if len(wav) < block:
+        return np.array([energy[-1] / len(wav)])
+    starts = np.arange(0, len(wav) - block + 1, step)
+    return (energy[starts + block] - energy[starts]) / block
+
+
+def _gated_loudness(powers: np.ndarray) -> float:
+    """ -70LUFS绝对门限和-10LU相对门限 """
+    levels = -0.691 + 10 * np.log10(powers + 1e-12)
+    gated = powers[levels > -70]
+    if not gated.size:
+        return float("-inf")
+    relative = -0.691 + 10 * np.log10(gated.mean()) - 10
+    gated = powers[(levels > -70) & (levels > relative)]
+    return float(-0.691 + 10 * np.log10(gated.mean()))
+
+
+def integrated_loudness(wav: np.ndarray, sr: int) -> float:
+    """ EBU R128积分响度(LUFS) """
+    wav = np.asarray(wav, dtype=np.float32).reshape(-1)
+    if not len(wav):
+        return float("-inf")
+    return _gated_loudness(_block_powers(wav, sr))
+
+
+def loudness_gain(current: float, peak: float, target: float = -16, peak_db: float = -1) -> float:
+    """ 把响度current调到target的线性增益，峰值不超过peak_db；静音返回1 """
+    if not np.isfinite(current) or peak <= 0:
+        return 1.0
+    return min(10 ** ((target - current) / 20), 10 ** (peak_db / 20) / peak)
+
+
+def normalize_loudness(wav: np.ndarray, sr: int, target: float = -16, peak_db: float = -1) -> np.ndarray:
+    """ 整体增益调到目标响度，峰值不超过peak_db，静音不处理 """
+    wav = np.asarray(wav, dtype=np.float32).reshape(-1)
+    if not len(wav):
+        return wav
+    gain = loudness_gain(integrated_loudness(wav, sr), float(np.abs(wav).max()), target, peak_db)
+    return (wav * gain).astype(np.float32)
+
+
+class LoudnessMeter:
+    """ 逐段累计响度块能量和峰值，整段不用留在内存里；段落交界处的块不计，对整体响度影响可以忽略 """
+
+    def __init__(self, sr: int):
+        self.sr = sr
+        self.powers = []
+        self.peak = 0.0
+
+    def add(self, wav: np.ndarray):
+        wav = np.asarray(wav, dtype=np.float32).reshape(-1)
+        if len(wav):
+            self.powers.append(_block_powers(wav, self.sr))
+            self.peak = max(self.peak, float(np.abs(wav).max()))
+
+    def gain(self, target: float = -16, peak_db: float = -1) -> float:
+        current = _gated_loudness(np.concatenate(self.powers)) if self.powers else float("-inf")
+        return loudness_gain(current, self.peak, target, peak_db)
+
+
+def postprocess(wav: np.ndarray, sr: int, speed: float = 1.0, pitch: float = 1.0) -> np.ndarray:
+    """ 每段合成后的变速变调，参数都是默认值时原样返回 """
+    if abs((speed or 1.0) - 1.0) >= 1e-3 or abs((pitch or 1.0) - 1.0) >= 1e-3:
+        wav = change_speed_pitch(wav, sr, speed, pitch)
+    return wav
+
+
+def finish_audio(wav: np.ndarray, sr: int, loudness: float = 0, trim_silence: bool = False) -> np.ndarray:
+    """ 拼好的整段输出在编码前去首尾静音、做响度归一化，句间停顿不受影响 """
+    if trim_silence:
+        wav = strip_silence(wav, sr)
+    if loudness:
+        wav = normalize_loudness(wav, sr, loudness)
+    return wav
+
+
+class StreamFinisher:
+    """
+    边合成边输出时的去静音和响度：只去掉第一段开头和最后一段结尾的静音，句间停顿保留。
+    后面的段落还没合成，增益由第一个有声音的段落决定，之后各段沿用同一个增益，
+    音量不会在段落之间跳变；后面的段落超过峰值上限时削波。
+    """
+
+    def __init__(self, sr: int, loudness: float = 0, trim_silence: bool = False, peak_db: float = -1):
+        self.sr = sr
+        self.loudness = loudness
+        self.trim_silence = trim_silence
+        self.limit = 10 ** (peak_db / 20)
+        self.peak_db = peak_db
+        self.gain = None
+        self.first = True
+
+    def __bool__(self):
+        return bool(self.loudness or self.trim_silence)
+
+    def process(self, wav: np.ndarray, last: bool = False) -> np.ndarray:
+        wav = np.asarray(wav, dtype=np.float32).reshape(-1)
+        if self.trim_silence:
+            wav = strip_silence(wav, self.sr, start=self.first, end=last)
+        self.first = False
+        if self.loudness and len(wav):
+            if self.gain is None:
+                current = integrated_loudness(wav, self.sr)
+                if np.isfinite(current):
+                    self.gain = loudness_gain(current, float(np.abs(wav).max()), self.loudness, self.peak_db)
+            if self.gain is not None:
+                wav = np.clip(wav * self.gain, -self.limit, self.limit).astype(np.float32)
+        return wav
+
+
+def scale_wav(path: str, gain: float, chunk_frames: int = 1 << 16):
+    """ 就地给16bit单声道wav文件乘增益，按块读写，内存占用和文件长度无关 """
+    if abs(gain - 1.0) < 1e-4:
+        return
+    with wave.open(path, "rb") as f:
+        frames = f.getnframes()
+    offset = os.path.getsize(path) - frames * 2
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        while data := f.read(chunk_frames * 2):
+            pcm = np.frombuffer(data, dtype="<i2").astype(np.float32) * gain
+            f.seek(-len(data), os.SEEK_CUR)
+            f.write(np.clip(pcm, -32768, 32767).astype("<i2").tobytes())
+
+
+class WavWriter:
+    """ 边合成边追加写入的wav文件，内存里不保留已写入的音频 """
+
+    def __init__(self, file: str, sr: int):
+        self.file = file
+        self.samples = 0
+        self._wave = wave.open(file, "wb")
+        self._wave.setnchannels(1)
+        self._wave.setsampwidth(2)
+        self._wave.setframerate(sr)
+
+    def write(self, wav: np.ndarray):
+        self._wave.writeframes(to_pcm16(wav))
+        self.samples += np.asarray(wav).size
+
+    def close(self):
+        self._wave.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _Sink:
+    """ 给PyAV写入的只追加缓冲区，不支持seek，取走后清空 """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def pop(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+class OpusEncoder:
+    """ ogg/opus编码器，多次encode()的输出按顺序拼起来就是完整文件，可用于流式返回 """
+    media_type = "audio/ogg"
+
+    def __init__(self, sr: int = 24000, bitrate: int = 32000):
+        self.sr = sr
+        self.pts = 0
+        self.sink = _Sink()
+        self.container = av.open(self.sink, mode="w", format="ogg")
+        self.stream = self.container.add_stream("libopus", rate=sr, layout="mono")
+        self.stream.bit_rate = bitrate
+
+    def encode(self, wav: np.ndarray) -> bytes:
+        pcm = np.frombuffer(to_pcm16(wav), dtype="<i2").reshape(1, -1)
+        if pcm.shape[1]:
+            frame = av.AudioFrame.from_ndarray(pcm, format="s16", layout="mono")
+            frame.sample_rate = self.sr
+            frame.pts = self.pts
+            self.pts += pcm.shape[1]
+            for packet in self.stream.encode(frame):
+                self.container.mux(packet)
+        return self.sink.pop()
+
+    def close(self) -> bytes:
+        for packet in self.stream.encode(None):
+            self.container.mux(packet)
+        self.container.close()
+        return self.sink.pop()
+
+
+class SilkEncoder:
+    """
+    silk编码器（QQ/微信语音格式），依赖pysilk。
+    pysilk只有整段编码接口，这里把PCM按20ms帧对齐后分块编码，去掉后续块的文件头再拼接，
+    不足一帧的尾巴留到下次，保证拼出来的是一个合法的silk文件。
+    """
+    media_type = "audio/silk"
+    HEADER = b"#!SILK_V3"
+
+    def __init__(self, sr: int = 24000, bitrate: int = 24000, tencent: bool = True):
+        import pysilk
+        self._pysilk = pysilk
+        self.sr = sr
+        self.bitrate = bitrate
+        self.tencent = tencent
+        self.frame = sr // 50
+        self.pending = b""
+        self.started = False
+
+    def _encode(self, pcm: bytes) -> bytes:
+        output = io.BytesIO()
+        self._pysilk.encode(io.BytesIO(pcm), output, self.sr, self.bitrate, tencent=self.tencent)
+        data = output.getvalue()
+        if not self.tencent and data.endswith(b"\xff\xff"):
+            data = data[:-2]
+        if self.started:
+            data = data[data.index(self.HEADER) + len(self.HEADER):]
+        self.started = True
+        return data
+
+    def encode(self, wav: np.ndarray) -> bytes:
+        pcm = self.pending + to_pcm16(wav)
+        cut = len(pcm) // (self.frame * 2) * self.frame * 2
+        self.pending = pcm[cut:]
+        return self._encode(pcm[:cut]) if cut else b""
+
+    def close(self) -> bytes:
+        data = self._encode(self.pending) if self.pending or not self.started else b""
+        self.pending = b""
+        if not self.tencent:
+            data += b"\xff\xff"
+        return data
+
+
+ENCODERS = {"ogg": OpusEncoder, "silk": SilkEncoder}
+
+
+def encode_audio(wav: np.ndarray, sr: int, suffix: str) -> bytes:
+    """ 整段波形在内存中编码 """
+    if suffix == "wav":
+        return encode_wav(wav, sr)
+    encoder = ENCODERS[suffix](sr)
+    return encoder.encode(wav) + encoder.close()
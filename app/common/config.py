@@ -51,6 +51,17 @@ class Config(QConfig):
     chattts_dir = ConfigItem("ChatTTS", "chattts_dir", "repo/chattts", FolderValidator())
     chattts_model = ConfigItem("ChatTTS", "chattts_model", "base_model/chattts", FolderValidator())
     chattts_enable = ConfigItem("ChatTTS", "chattts_enable", False, BoolValidator(), restart=True)
+    chattts_sample_cache = ConfigItem("ChatTTS", "chattts_sample_cache", 64)
+    # 在CPU上运行时各模块不分配权重，直接引用safetensors文件的只读mmap，多个进程共享page cache；
+    # .pt/.bin权重第一次加载时转换成safetensors
+    chattts_mmap = ConfigItem("ChatTTS", "chattts_mmap", False, BoolValidator())
+
+    # Stub 测试引擎（不加载模型，生成确定性的合成音频）
+    stub_enable = ConfigItem("Stub", "stub_enable", False, BoolValidator(), restart=True)
+    stub_char_duration = ConfigItem("Stub", "stub_char_duration", 0.22)
+    stub_latency = ConfigItem("Stub", "stub_latency", 0.05)
+    stub_rtf = ConfigItem("Stub", "stub_rtf", 0.1)
+    stub_speakers = ConfigItem("Stub", "stub_speakers", 4)
 
     # TTS Default
     output_dir = ConfigItem("TTS", "output_dir", "TEMP", FolderValidator())
@@ -60,6 +71,55 @@ class Config(QConfig):
     timeout = ConfigItem("TTS", "timeout", 600)
     default_avatar = ConfigItem("TTS", "default_avatar", "")
     model_dir = ConfigItem("TTS", "model_dir", "models")
+    long_text_chars = ConfigItem("TTS", "long_text_chars", 500)
+    cache_max_age = ConfigItem("TTS", "cache_max_age", 86400)
+
+    # 引擎按需加载，engine_classes为额外引擎 {名称: "模块:类名"}，内存预算单位MB，0为不限制
+    engine_classes = ConfigItem("Engine", "engine_classes", {})
+    engine_memory_budget = ConfigItem("Engine", "engine_memory_budget", 0)
+    engine_idle_timeout = ConfigItem("Engine", "engine_idle_timeout", 0)
+    engine_preload = ConfigItem("Engine", "engine_preload", [])
+    # 重新加载时最多等正在处理的请求多少秒，0为一直等
+    engine_drain_timeout = ConfigItem("Engine", "engine_drain_timeout", 60)
+
+    # 结果缓存：seed固定的请求按参数缓存合成结果，cache_random_seed打开后seed=-1的也缓存（之后都返回第一次的结果）
+    result_cache_enable = ConfigItem("Cache", "result_cache_enable", True, BoolValidator())
+    cache_random_seed = ConfigItem("Cache", "cache_random_seed", False, BoolValidator())
+    cache_max_size = ConfigItem("Cache", "cache_max_size", 1024)  # MB，0为不限制
+    # 预热：warmup_dir下的txt每行一句，按发音人×格式提前合成；warmup_params为公共参数，线上请求参数一致才能命中
+    warmup_dir = ConfigItem("Cache", "warmup_dir", "")
+    warmup_speakers = ConfigItem("Cache", "warmup_speakers", [])
+    warmup_formats = ConfigItem("Cache", "warmup_formats", ["wav"])
+    warmup_params = ConfigItem("Cache", "warmup_params", {"seed": 2024})
+    warmup_on_start = ConfigItem("Cache", "warmup_on_start", False, BoolValidator())
+
+    # 调度
+    scheduler_workers = ConfigItem("Scheduler", "scheduler_workers", 1)
+    bulk_text_chars = ConfigItem("Scheduler", "bulk_text_chars", 300)
+    priority_keys = ConfigItem("Scheduler", "priority_keys", {})
+    client_weights = ConfigItem("Scheduler", "client_weights", {})
+    # 过载保护：排队等推理的请求超过max_queue时直接返回503，0为不限制
+    max_queue = ConfigItem("Scheduler", "max_queue", 0)
+
+    # 路由模式 python -m WebTTS3.tts.router，affinity_slack为亲和节点比最空闲节点多几个请求以内仍走亲和节点
+    router_backends = ConfigItem("Router", "router_backends", [])
+    router_port = ConfigItem("Router", "router_port", 20090)
+    router_health_interval = ConfigItem("Router", "router_health_interval", 2.0)
+    router_retries = ConfigItem("Router", "router_retries", 2)
+    router_affinity_slack = ConfigItem("Router", "router_affinity_slack", 2)
+
+    # 链路追踪，trace_file为空时不导出；trace_enable修改后重启生效
+    trace_enable = ConfigItem("Trace", "trace_enable", True, BoolValidator())
+    trace_file = ConfigItem("Trace", "trace_file", "")
+
+    profile_interval = ConfigItem("Trace", "profile_interval", 0.005)
+
+    # 批量任务
+    job_concurrency = ConfigItem("Job", "job_concurrency", 1)
+    job_segment_chars = ConfigItem("Job", "job_segment_chars", 100)
+    # /batch 每次推理最多几段文本，以及一次请求最多几条
+    batch_infer_size = ConfigItem("Job", "batch_infer_size", 8)
+    batch_max_items = ConfigItem("Job", "batch_max_items", 200)
 
 
 VOICER_AVATAR = ""
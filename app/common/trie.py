@@ -1,14 +1,21 @@
 # coding: utf-8
-from queue import Queue
+from collections import deque
+
+try:
+    from pypinyin import lazy_pinyin, Style
+except ImportError:
+    lazy_pinyin = None
 
 
 class Trie:
-    """ String trie """
+    """ String trie, children are stored in a dict so any unicode character works """
+
+    __slots__ = ("key", "value", "children", "isEnd")
 
     def __init__(self):
         self.key = ''
         self.value = None
-        self.children = [None] * 26
+        self.children = {}
         self.isEnd = False
 
     def insert(self, key: str, value):
@@ -17,14 +24,11 @@ class Trie:
 
         node = self
         for c in key:
-            i = ord(c) - 97
-            if not 0 <= i < 26:
-                return
-
-            if not node.children[i]:
-                node.children[i] = Trie()
+            child = node.children.get(c)
+            if child is None:
+                child = node.children[c] = Trie()
 
-            node = node.children[i]
+            node = child
 
         node.isEnd = True
         node.key = key
@@ -43,12 +47,10 @@ class Trie:
         prefix = prefix.lower()
         node = self
         for c in prefix:
-            i = ord(c) - 97
-            if not (0 <= i < 26 and node.children[i]):
+            node = node.children.get(c)
+            if node is None:
                 return None
 
-            node = node.children[i]
-
         return node
 
     def items(self, prefix):
@@ -57,17 +59,90 @@ class Trie:
         if not node:
             return []
 
-        q = Queue()
+        q = deque([node])
         result = []
-        q.put(node)
 
-        while not q.empty():
-            node = q.get()
+        while q:
+            node = q.popleft()
             if node.isEnd:
                 result.append((node.key, node.value))
 
-            for c in node.children:
-                if c:
-                    q.put(c)
+            q.extend(node.children.values())
 
         return result
+
+
+def pinyin_keys(name: str) -> list:
+    """ 名称的全拼和首字母，没有安装pypinyin时返回空 """
+    if lazy_pinyin is None or not name:
+        return []
+    full = lazy_pinyin(name)
+    initials = lazy_pinyin(name, style=Style.FIRST_LETTER)
+    return ["".join(full).lower(), "".join(initials).lower()]
+
+
+class SearchIndex:
+    """
+    发音人搜索索引：名称/全拼/首字母走前缀树，每个节点直接存子树里的编号，前缀查询不用遍历子树；
+    另外对名称建二元组倒排，兼容原来的子串匹配。返回结果按插入顺序。
+    """
+
+    def __init__(self, names=()):
+        self.root = [{}, []]  # [children, ids]
+        self.names = []
+        self.grams = {}
+        for name in names:
+            self.add(name)
+
+    def _insert(self, key: str, index: int):
+        node = self.root
+        for c in key:
+            child = node[0].get(c)
+            if child is None:
+                child = node[0][c] = [{}, []]
+            node = child
+            if not node[1] or node[1][-1] != index:
+                node[1].append(index)
+
+    def add(self, name: str) -> int:
+        index = len(self.names)
+        key = name.lower()
+        self.names.append(key)
+        for k in [key] + pinyin_keys(name):
+            self._insert(k, index)
+        for gram in self._grams(key):
+            self.grams.setdefault(gram, set()).add(index)
+        return index
+
+    @staticmethod
+    def _grams(key: str) -> set:
+        return set(key) | {key[i:i + 2] for i in range(len(key) - 1)}
+
+    def prefix(self, keyword: str) -> list:
+        node = self.root
+        for c in keyword.lower():
+            node = node[0].get(c)
+            if node is None:
+                return []
+        return node[1]
+
+    def substring(self, keyword: str) -> set:
+        keyword = keyword.lower()
+        grams = [keyword] if len(keyword) == 1 else [keyword[i:i + 2] for i in range(len(keyword) - 1)]
+        postings = sorted((self.grams.get(gram, set()) for gram in grams), key=len)
+        if not postings or not postings[0]:
+            return set()
+        candidates = postings[0].intersection(*postings[1:])
+        if len(keyword) <= 2:
+            return candidates
+        return {i for i in candidates if keyword in self.names[i]}
+
+    def search(self, keyword: str) -> list:
+        """ 前缀（名称/拼音/首字母）或名称子串匹配的编号 """
+        if not keyword:
+            return list(range(len(self.names)))
+        prefix = self.prefix(keyword)
+        extra = self.substring(keyword).difference(prefix)
+        if not extra:
+            return list(prefix)
+        return sorted(extra.union(prefix))
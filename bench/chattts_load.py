@@ -0,0 +1,80 @@
+"""
+ChatTTS冷启动基准：python bench/chattts_load.py --model D:/models/ChatTTS
+常规加载（chat.load）和mmap加载（chattts_mmap）各在一个新进程里跑，输出加载耗时和加载前后的内存：
+RSS、其中进程私有的匿名内存（anon）和文件映射（file，多个进程共享同一份page cache），以及峰值RSS。
+--drop-caches 每轮前清空page cache（需要root），测磁盘冷读；不加时测的是文件已在page cache里的启动。
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+
+MODES = {"regular": False, "mmap": True}
+
+
+def memory() -> dict:
+    """ /proc/self/status里的内存项，单位MB """
+    fields = {"VmRSS": "rss", "RssAnon": "anon", "RssFile": "file", "VmHWM": "peak"}
+    data = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in fields:
+                data[fields[name]] = int(value.split()[0]) / 1024
+    return data
+
+
+def child(mode: str, model: str):
+    from WebTTS3.app.common.config import cfg
+
+    cfg.set(cfg.chattts_model, model, save=False)
+    cfg.set(cfg.chattts_mmap, MODES[mode], save=False)
+    from WebTTS3.tts.engine.e_chattts import ChatTTSEngine
+
+    engine = ChatTTSEngine()
+    before = memory()
+    start = time.perf_counter()
+    engine.load()
+    seconds = time.perf_counter() - start
+    print(json.dumps({"mode": mode, "seconds": seconds, "before": before, "after": memory()}))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ChatTTS常规加载和mmap加载的耗时、内存")
+    parser.add_argument("--model", help="模型目录，不设置用配置chattts_model")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--drop-caches", action="store_true")
+    parser.add_argument("--child", choices=list(MODES), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.model is None:
+        from WebTTS3.app.common.config import cfg
+        args.model = cfg.get(cfg.chattts_model)
+    if args.child:
+        child(args.child, args.model)
+        return
+
+    print(f"{'mode':>8} {'seconds':>8} {'rss MB':>15} {'anon MB':>15} {'file MB':>15} {'peak MB':>8}")
+    for _ in range(args.repeat):
+        for mode in args.modes:
+            if args.drop_caches:
+                subprocess.run(["sync"], check=True)
+                with open("/proc/sys/vm/drop_caches", "w") as f:
+                    f.write("3\n")
+            out = subprocess.run([sys.executable, __file__, "--child", mode, "--model", args.model],
+                                 capture_output=True, text=True, check=True).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            before, after = result["before"], result["after"]
+            print(f"{mode:>8} {result['seconds']:>8.2f} "
+                  + " ".join(f"{before[k]:>6.0f}->{after[k]:>6.0f}" for k in ("rss", "anon", "file"))
+                  + f" {after['peak']:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
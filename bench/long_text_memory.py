@@ -0,0 +1,67 @@
+"""
+长文本流式合成的内存基准，用Stub引擎，不需要模型：
+python bench/long_text_memory.py --chars 5000 20000 50000
+对每个长度调用TTSInfer.infer_long，用tracemalloc记录峰值内存（numpy数组也会统计在内），
+峰值应该只和job_segment_chars、batch_size有关，不随文本长度增长。--plain 用没有标点的文本。
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+
+from WebTTS3.app.common.config import cfg
+
+SENTENCE = "今天的天气很好，我们一起去公园散步，顺便看看湖边新开的花。"
+
+
+def make_text(chars: int, plain=False) -> str:
+    unit = SENTENCE.replace("，", "").replace("。", "") if plain else SENTENCE
+    return (unit * (chars // len(unit) + 1))[:chars]
+
+
+async def run(lengths, plain, batch_size):
+    from WebTTS3.tts.infer import TTSInfer
+    from WebTTS3.tts.text import segment_text
+
+    tts_infer = TTSInfer()
+    # 先加载一次，模型加载和首次分配不算进峰值
+    await tts_infer.infer_long({"text": make_text(50), "spk": "bench", "seed": 1, "batch_size": batch_size}, "Stub")
+    print(f"{'chars':>8} {'segments':>9} {'peak MB':>9} {'wav MB':>8} {'seconds':>8}")
+    for chars in lengths:
+        text = make_text(chars, plain)
+        args = {"text": text, "spk": "bench", "seed": 1, "batch_size": batch_size}
+        tracemalloc.start()
+        start = time.perf_counter()
+        _, path = await tts_infer.infer_long(args, "Stub")
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        segments = len(segment_text(text, cfg.get(cfg.job_segment_chars)))
+        print(f"{chars:>8} {segments:>9} {peak / 2 ** 20:>9.1f} {os.path.getsize(path) / 2 ** 20:>8.1f} "
+              f"{seconds:>8.2f}")
+        os.remove(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="长文本流式合成的峰值内存")
+    parser.add_argument("--chars", type=int, nargs="+", default=[5000, 20000, 50000])
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--plain", action="store_true", help="没有标点的文本，测超长句子的切分")
+    args = parser.parse_args(argv)
+
+    output_dir = tempfile.mkdtemp(prefix="webtts3_bench_")
+    for item, value in ((cfg.stub_enable, True), (cfg.chattts_enable, False), (cfg.stub_rtf, 0),
+                        (cfg.stub_latency, 0), (cfg.output_dir, output_dir), (cfg.trace_enable, False)):
+        cfg.set(item, value, save=False)
+    asyncio.run(run(args.chars, args.plain, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
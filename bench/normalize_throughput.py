@@ -0,0 +1,78 @@
+"""
+文本规范化吞吐基准：python bench/normalize_throughput.py --chars 200000
+分别测不命中缓存（每轮清空按句缓存）和全部命中缓存时每秒处理的字数，语料混合了数字、日期、单位等各类规则。
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+
+from WebTTS3.tts.text import normalize_text, normalize_sentence
+
+TEMPLATES = [
+    "会议定在{y}年{m}月{d}日{h}:{mi}开始，预计持续{n}分钟。",
+    "今年营收{big}元，同比增长{p}%，其中海外业务占{q}%。",
+    "请拨打{phone}联系客服，或访问https://tts.berstar.cn查看说明。",
+    "这批货重{w}kg，运费{price}美元，{a}~{b}天送达。",
+    "版本{v}修复了{n}个问题，安装包大小{size}MB。",
+    "{a}+{b}={s}，{c}-{a2}={r}，{y}/{m}的报表已经发布。",
+    "今天天气很好，我们一起去公园散步，顺便看看湖边新开的花。",
+]
+
+
+def make_corpus(chars: int, seed=0) -> list:
+    rng = random.Random(seed)
+    sentences, total = [], 0
+    while total < chars:
+        a, b = rng.randint(1, 99), rng.randint(100, 999)
+        c = rng.randint(100, 999)
+        a2 = rng.randint(1, 99)
+        sentence = rng.choice(TEMPLATES).format(
+            y=rng.randint(1990, 2030), m=rng.randint(1, 12), d=rng.randint(1, 28), h=rng.randint(0, 23),
+            mi=f"{rng.randint(0, 59):02d}", n=rng.randint(1, 500), big=f"{rng.randint(1, 10 ** 9):,}",
+            p=round(rng.uniform(-20, 80), 1), q=rng.randint(1, 99), phone=f"1{rng.randint(3, 9)}{rng.randint(0, 10 ** 9 - 1):09d}",
+            w=round(rng.uniform(0.1, 500), 1), price=round(rng.uniform(1, 9999), 2), a=a, b=b,
+            v=f"{rng.randint(1, 9)}.{rng.randint(0, 20)}.{rng.randint(0, 99)}", size=rng.randint(1, 4096),
+            s=a + b, c=c, a2=a2, r=c - a2)
+        sentences.append(sentence)
+        total += len(sentence)
+    return sentences
+
+
+def measure(sentences, rounds: int, cold: bool) -> float:
+    chars = sum(len(s) for s in sentences)
+    best = float("inf")
+    for _ in range(rounds):
+        if cold:
+            normalize_sentence.cache_clear()
+        start = time.perf_counter()
+        for sentence in sentences:
+            normalize_text(sentence)
+        best = min(best, time.perf_counter() - start)
+    return chars / best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="文本规范化吞吐（字/秒）")
+    parser.add_argument("--chars", type=int, default=200000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    sentences = make_corpus(args.chars)
+    unique = list(dict.fromkeys(sentences))
+    print(f"语料{sum(map(len, sentences))}字，{len(sentences)}句，不重复{len(unique)}句")
+    print(f"不命中缓存: {measure(unique, args.rounds, cold=True):>12,.0f} 字/秒")
+    # 缓存只有8192句，命中测试用能放进缓存的部分
+    warm = unique[:normalize_sentence.cache_info().maxsize]
+    normalize_sentence.cache_clear()
+    measure(warm, 1, cold=False)
+    print(f"全部命中缓存: {measure(warm, args.rounds, cold=False):>12,.0f} 字/秒")
+
+
+if __name__ == "__main__":
+    main()
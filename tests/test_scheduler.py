@@ -0,0 +1,51 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from WebTTS3.tts.scheduler import Scheduler
+
+
+def test_cancelled_waiter_released_in_same_iteration():
+    """ 排队的请求和释放名额发生在同一轮事件循环里，名额不能泄漏，后面的请求不能卡住 """
+
+    async def main():
+        scheduler = Scheduler(workers=1)
+        release = asyncio.Event()
+        entered = asyncio.Event()
+
+        async def holder():
+            async with scheduler.slot():
+                entered.set()
+                await release.wait()
+
+        async def waiter():
+            async with scheduler.slot():
+                pass
+
+        first = asyncio.create_task(holder())
+        await entered.wait()
+        second = asyncio.create_task(waiter())
+        await asyncio.sleep(0)
+        assert scheduler.queued() == 1
+
+        # 第一个请求被唤醒去释放名额之前，排队的请求被取消（它自己还没来得及出队）
+        release.set()
+        second.cancel()
+        await first
+        try:
+            await second
+        except asyncio.CancelledError:
+            pass
+        assert scheduler.running == 0
+        assert scheduler.queued() == 0
+
+        async def third():
+            async with scheduler.slot():
+                return True
+
+        assert await asyncio.wait_for(third(), 1)
+        assert scheduler.running == 0
+
+    asyncio.run(main())
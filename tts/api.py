@@ -8,23 +8,44 @@ sys.path.insert(0, os.path.dirname(sys.path[0]))
 from PySide6 import QtAsyncio
 from PySide6.QtCore import QThread, QObject, Slot, Signal, Property, QEventLoop
 from PySide6.QtGui import QGuiApplication
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect, Request
 import uvicorn
 import asyncio
+import base64
+import io
+import json
+import zipfile
 from loguru import logger
 
-from starlette.responses import FileResponse, Response
-
-from WebTTS3.tts.api_models import Params
-from WebTTS3.tts.infer import TTSInfer
+from starlette.responses import Response, StreamingResponse, PlainTextResponse, JSONResponse
+
+from WebTTS3.tts.api_models import Params, JobRequest, SSMLRequest, RegisterSpeaker, BatchRequest, BatchItem, \
+    WarmUpRequest
+from WebTTS3.tts.jobs import JobManager, JobState
+from WebTTS3.tts.infer import TTSInfer, BaseInfer
+from WebTTS3.tts.text import split_sentences, normalize_text
+from WebTTS3.tts.ssml import parse_ssml
+from WebTTS3.tts.responses import audio_response, key_etag, not_modified
+from WebTTS3.tts.singleflight import SingleFlight, request_key
+from WebTTS3.tts.scheduler import scheduler, classify, current_ticket
+from WebTTS3.tts.cancel import CancelToken, CancelReason, InferCancelled, current_token, wait_request
+from WebTTS3.tts.trace import span, TraceMiddleware
+from WebTTS3.tts.profiler import SamplingProfiler
+from WebTTS3.tts.cache import ResultCache
+from WebTTS3.tts.warmup import WarmUp, read_phrases
 
 from fastapi.middleware.cors import CORSMiddleware
 from WebTTS3.app.common.config import cfg, VERSION
 from WebTTS3.app.common.Singleton import Singleton
-from WebTTS3.app.common.audio import reSize
+from WebTTS3.app.common.audio import reSize, to_pcm16, encode_wav, encode_audio, ENCODERS, StreamFinisher
+import numpy as np
 from contextlib import asynccontextmanager
 
 tts_infer: TTSInfer = None
+job_manager: JobManager = None
+result_cache: ResultCache = None
+warm_up: WarmUp = None
+single_flight = SingleFlight()
 tts_config = {}
 output_dir = cfg.get(cfg.output_dir)
 
@@ -32,10 +53,22 @@ output_dir = cfg.get(cfg.output_dir)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # startup 逻辑
-    global tts_infer, output_dir
+    global tts_infer, output_dir, job_manager, result_cache, warm_up
     output_dir = cfg.get(cfg.output_dir)  # 获取配置中的输出目录
     tts_infer = TTSInfer()  # 实例化 TTSInfer 对象
     await load_tts_config()  # 加载 TTS 配置
+    tts_infer._registry.start()  # 定期卸载空闲引擎
+    for engine in cfg.get(cfg.engine_preload):
+        try:
+            await tts_infer._registry.ensure_loaded(engine)
+        except Exception as e:
+            logger.error(f"{engine} 预加载失败: {e}")
+    job_manager = JobManager(tts_infer, output_dir)
+    job_manager.resume()  # 继续重启前未完成的任务
+    result_cache = ResultCache(output_dir)
+    warm_up = WarmUp(lambda item: params_key(prepare_params(item)), render_to_cache, result_cache)
+    if cfg.get(cfg.warmup_on_start):
+        start_warmup()
     logger.debug("初始化完成")
     try:
         yield  # 应用启动并运行
@@ -86,16 +119,59 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id", "Server-Timing", "ETag", "Content-Range"],
 )
 
 
+# 开关在启动时读取，关闭时不挂中间件
+if cfg.get(cfg.trace_enable):
+    app.add_middleware(TraceMiddleware)
+
+
 @app.get('/config')
 async def get_config():
     await load_tts_config()
     return tts_config
 
 
-async def handle(params: Params):
+def overloaded() -> bool:
+    limit = cfg.get(cfg.max_queue)
+    return bool(limit) and scheduler.queued() >= limit
+
+
+def busy_response():
+    return JSONResponse({"code": 3, "msg": "服务繁忙，请稍后重试"}, status_code=503, headers={"Retry-After": "1"})
+
+
+@app.get("/ready", description="就绪检查，还没初始化完或排队过多时返回503", tags=["状态"])
+async def ready():
+    if tts_infer is None:
+        return JSONResponse({"ready": False, "msg": "初始化中"}, status_code=503)
+    data = {"ready": True, "queued": scheduler.queued(), "running": scheduler.running, "workers": scheduler.workers}
+    if overloaded():
+        return JSONResponse({**data, "ready": False, "msg": "繁忙"}, status_code=503, headers={"Retry-After": "1"})
+    return data
+
+
+def cancelled_response(e: InferCancelled):
+    """ 客户端断开返回499（nginx的约定），超过截止时间返回504 """
+    return Response(status_code=499 if e.reason is CancelReason.disconnected else 504)
+
+
+def request_deadline(request: Request, deadline: float = 0) -> float:
+    """ 参数deadline优先，其次X-Deadline头；头的值不是数字时忽略 """
+    if deadline:
+        return deadline
+    value = request.headers.get("x-deadline")
+    try:
+        return float(value) if value else 0
+    except ValueError:
+        logger.debug(f"X-Deadline无效，忽略: {value}")
+        return 0
+
+
+def resolve_speaker(params: Params):
+    """ 发音人格式为 名称__引擎 """
     if params.spk:
         spk_info = params.spk.split("__")
     else:
@@ -103,33 +179,477 @@ async def handle(params: Params):
     if len(spk_info) == 2:
         params.spk = spk_info[0]
         params.engine = spk_info[1]
+
+
+def params_key(params: Params) -> str:
+    """ 结果缓存和single-flight共用的请求键 """
+    return request_key(params.dict(exclude={"deadline", "profile"}))
+
+
+def prepare_params(data: dict) -> Params:
+    params = Params(**data)
+    resolve_speaker(params)
+    return params
+
+
+def cache_enabled(params: Params) -> bool:
+    """ 只缓存结果确定的请求；返回本地路径的请求不缓存 """
+    return (cfg.get(cfg.result_cache_enable) and not params.local and not params.stream
+            and (params.seed != -1 or cfg.get(cfg.cache_random_seed)))
+
+
+async def render_to_cache(data: dict):
+    """ 预热用：合成一条并写入结果缓存 """
+    params = prepare_params(data)
+    content, audio, media_type = await render(params)
+    await asyncio.to_thread(result_cache.put, params_key(params), media_type, content, audio)
+
+
+def start_warmup(phrases=None, speakers=None, formats=None, params=None) -> bool:
+    phrases = phrases if phrases is not None else read_phrases(cfg.get(cfg.warmup_dir))
+    speakers = speakers if speakers is not None else cfg.get(cfg.warmup_speakers)
+    formats = [getattr(fmt, "value", fmt) for fmt in (formats or cfg.get(cfg.warmup_formats))]
+    params = params if params is not None else cfg.get(cfg.warmup_params)
+    if params.get("seed", -1) == -1 and not cfg.get(cfg.cache_random_seed):
+        logger.warning("预热参数没有固定seed，结果不会被缓存命中")
+    return warm_up.start(phrases, speakers, formats, params)
+
+
+async def render(params: Params):
+    """ 合成并编码，返回(音频内容, 文件路径, media_type)，内容和路径只有一个有值 """
+    if params.format.value in ENCODERS and not params.local:
+        # ogg(opus)/silk 直接在内存中编码，不再走ffmpeg
+        wav, sr = await tts_infer.synthesize(params.dict(), params.engine)
+        with span("encode", format=params.format.value):
+            content = await asyncio.to_thread(encode_audio, wav, sr, params.format.value)
+        return content, None, ENCODERS[params.format.value].media_type
+    code, audio = await tts_infer.infer(params.dict(), params.engine)
+    if code != 1:
+        raise RuntimeError(audio)
+    audio = pathlib.Path(audio).as_posix()
+    if params.local or params.format == "wav":
+        return None, audio, "audio/wav"
+    with span("reSize", format=params.format.value):
+        if params.engine == "ChatTTS":
+            audio = await asyncio.to_thread(reSize, audio, hz=24000, suffix=params.format.value)
+        else:
+            audio = await asyncio.to_thread(reSize, audio, suffix=params.format.value)
+    return None, audio, "audio/mpeg"
+
+
+async def handle(params: Params, request: Request):
+    resolve_speaker(params)
     if params.text is None:
         params.text = "欢迎使用WebTTS,祝您使用愉快。"
+    current_ticket.set(classify(request.headers, request.client.host if request.client else "", params.text))
+    if params.stream and params.format.value in ENCODERS:
+        if overloaded():
+            return busy_response()
+        try:
+            return stream_audio(params)
+        except Exception as e:
+            return {"code": 2, "msg": f"{e}"}
+    if params.profile:
+        # 不走single-flight，保证采样到的是这次请求自己的合成
+        profiler = SamplingProfiler(cfg.get(cfg.profile_interval)).start()
+        try:
+            await render(params)
+        except Exception as e:
+            logger.error(e)
+        finally:
+            profiler.stop()
+        return PlainTextResponse(profiler.collapsed())
+    key = params_key(params)
+    # 固定种子的请求结果确定，ETag直接由请求键算出，浏览器重复播放时不用合成就能返回304
+    etag = key_etag(key) if params.seed != -1 and not params.local else None
+    if etag:
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+    use_cache = cache_enabled(params)
+    if use_cache:
+        entry = result_cache.get(key)
+        if entry is not None:
+            try:
+                with span("respond", cache="hit"):
+                    return await audio_response(request, entry["media_type"], path=entry["path"], cacheable=True,
+                                                etag=etag, ranges=True)
+            except FileNotFoundError:
+                # 读索引和打开文件之间被删掉了，按没命中处理
+                logger.debug(f"缓存文件已被删除: {entry['path']}")
+    if overloaded():
+        return busy_response()
+    token = CancelToken()
+
+    async def run():
+        current_token.set(token)
+        with span("render", engine=params.engine, spk=params.spk):
+            result = await render(params)
+        if use_cache:
+            with span("cache_put"):
+                await asyncio.to_thread(result_cache.put, key, result[2], result[0], result[1])
+        return result
+
+    # 完全相同的请求正在合成时，直接复用同一个结果；客户端断开或超时后不再等待
+    flight = asyncio.ensure_future(single_flight.do(key, run, token))
+    deadline = request_deadline(request, params.deadline)
     try:
-        code, audio = await tts_infer.infer(params.dict(), params.engine)
+        content, audio, media_type = await wait_request(request, flight, deadline)
+    except InferCancelled as e:
+        logger.info(f"放弃合成: {e}")
+        return cancelled_response(e)
     except Exception as e:
         return {"code": 2, "msg": f"{e}"}
-    if code == 1:
-        audio = pathlib.Path(audio).as_posix()
-        if params.local:
-            return {"code": code, "file": audio, "url": "", "data": audio}
-        if params.format == "wav":
-            return FileResponse(audio)
-        if params.engine == "ChatTTS":
-            return FileResponse(reSize(audio, hz=24000, suffix="ogg"))
-        return FileResponse(reSize(audio, suffix="ogg"))
-    else:
-        return {"code": code, "msg": audio}
+    if params.local:
+        return {"code": 1, "file": audio, "url": "", "data": audio}
+    with span("respond"):
+        return await audio_response(request, media_type, content=content, path=audio, cacheable=etag is not None,
+                                    etag=etag)
+
+
+def stream_audio(params: Params):
+    """ 边合成边编码，编码器状态在各段之间复用 """
+    encoder = ENCODERS[params.format.value](tts_infer._engine[params.engine].sample_rate)
+    wavs = tts_infer.stream(params.dict(), params.engine)
+
+    async def body():
+        async for wav in wavs:
+            yield await asyncio.to_thread(encoder.encode, wav)
+        yield encoder.close()
+
+    return StreamingResponse(body(), media_type=encoder.media_type)
+
+
+@app.post("/speakers", description="注册参考音频，返回可重复使用的发音人", tags=["发音人"], dependencies=dependencies)
+async def register_speaker(req: RegisterSpeaker):
+    try:
+        if req.audio:
+            data = base64.b64decode(req.audio)
+        elif req.ref_wav_path:
+            data = await asyncio.to_thread(pathlib.Path(req.ref_wav_path).read_bytes)
+        else:
+            return {"code": 2, "msg": "需要ref_wav_path或audio"}
+        spk = await tts_infer.register_speaker(data, req.prompt_text, req.name, req.engine)
+    except Exception as e:
+        return {"code": 2, "msg": f"{e}"}
+    await load_tts_config()
+    return {"code": 0, "spk": spk}
+
+
+@app.get("/metrics", description="运行指标", tags=["状态"])
+async def get_metrics():
+    return {"singleflight": single_flight.stats(), "scheduler": scheduler.stats(),
+            "engines": tts_infer._registry.stats(), "cache": result_cache.stats()}
+
+
+@app.post("/admin/warmup", description="按发音人和格式把常用语提前合成进结果缓存，参数不设置时用配置", tags=["状态"])
+async def warmup_start(req: WarmUpRequest):
+    if not start_warmup(req.phrases, req.speakers, req.formats, req.params):
+        return {"code": 1, "msg": "预热正在进行", **await warm_up.stats()}
+    return {"code": 0, **await warm_up.stats()}
+
+
+@app.get("/admin/warmup", description="预热进度和缓存覆盖率", tags=["状态"])
+async def warmup_status():
+    return {"code": 0, **await warm_up.stats(), "cache": result_cache.stats()}
+
+
+@app.delete("/admin/warmup", description="停止预热", tags=["状态"])
+async def warmup_stop():
+    warm_up.stop()
+    return {"code": 0, **await warm_up.stats()}
+
+
+@app.post("/admin/engines/{name}/reload", description="不重启进程重新加载引擎模型", tags=["状态"])
+async def reload_engine(name: str):
+    if name not in tts_infer._engine:
+        return {"code": 2, "msg": f"{name}引擎没启用"}
+    timeout = float(cfg.get(cfg.engine_drain_timeout))
+    reloaded = await tts_infer._registry.reload(name, timeout if timeout > 0 else None)
+    lifecycle = tts_infer._registry.lifecycles[name]
+    if not reloaded:
+        msg = lifecycle.error if lifecycle.state.value == "failed" else f"{timeout:g}秒内请求没处理完，没有重新加载"
+        return {"code": 1, "msg": f"{name}: {msg}", "state": lifecycle.state.value}
+    return {"code": 0, "state": lifecycle.state.value}
+
+
+@app.get("/admin/profile", description="对所有线程采样seconds秒，返回collapsed格式调用栈，可直接生成火焰图",
+         tags=["状态"], response_class=PlainTextResponse)
+async def admin_profile(seconds: float = 10, interval: float = 0):
+    profiler = SamplingProfiler(interval or cfg.get(cfg.profile_interval))
+    await asyncio.to_thread(profiler.run, min(max(seconds, 0.1), 300))
+    return PlainTextResponse(profiler.collapsed())
 
 
 @app.get("/", description="TTS GET接口", tags=["语音合成"], dependencies=dependencies)
-async def tts_get(params: Params = Depends(Params)):
-    return await handle(params)
+async def tts_get(request: Request, params: Params = Depends(Params)):
+    return await handle(params, request)
 
 
 @app.post("/", description="TTS GET接口", tags=["语音合成"], dependencies=dependencies)
-async def tts_post(params: Params):
-    return await handle(params)
+async def tts_post(request: Request, params: Params):
+    return await handle(params, request)
+
+
+@app.post("/ssml", description="SSML合成接口", tags=["语音合成"], dependencies=dependencies)
+async def tts_ssml(request: Request, req: SSMLRequest):
+    current_ticket.set(classify(request.headers, request.client.host if request.client else "", req.ssml))
+    if overloaded():
+        return busy_response()
+    try:
+        segments = parse_ssml(req.ssml)
+    except Exception as e:
+        return {"code": 2, "msg": f"SSML解析失败:{e}"}
+
+    # 参数相同的段落一组，每组按batch_infer_size段一次推理
+    groups = {}
+    for index, segment in enumerate(segments):
+        if "text" in segment:
+            key = json.dumps(segment["params"], sort_keys=True)
+            groups.setdefault(key, []).append(index)
+    size = max(int(cfg.get(cfg.batch_infer_size)), 1)
+    token = CancelToken()
+
+    async def run():
+        current_token.set(token)
+        wavs = {}
+        sample_rate = 24000
+        # 没有<voice>的段落共用第一次解析出的发音人，不指定发音人时不会每组各抽一个随机音色
+        default_speaker = None
+        for key, indexes in groups.items():
+            own = json.loads(key)
+            params = Params(**{"spk": req.spk, "seed": req.seed, **own})
+            resolve_speaker(params)
+            args = params.dict()
+            if "spk" not in own and default_speaker:
+                args["speaker"] = default_speaker
+            ctx = await tts_infer.prepare(args, params.engine)
+            if "spk" not in own and default_speaker is None:
+                default_speaker = ctx.speaker
+            sample_rate = tts_infer._engine[params.engine].sample_rate
+            for start in range(0, len(indexes), size):
+                chunk = indexes[start:start + size]
+                results = await tts_infer.generate([segments[i]["text"] for i in chunk], ctx, params.engine)
+                wavs.update(zip(chunk, results))
+        return wavs, sample_rate
+
+    task = asyncio.ensure_future(run())
+    try:
+        wavs, sample_rate = await wait_request(request, task, request_deadline(request, req.deadline))
+    except InferCancelled as e:
+        token.cancel(e.reason)
+        logger.info(f"放弃SSML合成: {e}")
+        return cancelled_response(e)
+    except Exception as e:
+        return {"code": 2, "msg": f"{e}"}
+
+    audio = []
+    for index, segment in enumerate(segments):
+        if "break" in segment:
+            audio.append(np.zeros(int(segment["break"] * sample_rate / 1000), dtype=np.float32))
+        else:
+            audio.append(wavs[index])
+    audio = np.concatenate(audio) if audio else np.zeros(0, dtype=np.float32)
+    return await audio_response(request, "audio/wav", content=encode_wav(audio, sample_rate),
+                                cacheable=req.seed != -1)
+
+
+def pack_batch(items: list, params: list, results: list, suffix: str) -> bytes:
+    """ 把批量合成结果打成zip，附带manifest.json记录每条的时长 """
+    buffer = io.BytesIO()
+    manifest, names = [], set()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as z:
+        for index, (item, param, (wav, sr)) in enumerate(zip(items, params, results)):
+            data = encode_wav(wav, sr) if suffix == "wav" else encode_audio(wav, sr, suffix)
+            name = BaseInfer.clean_filename(item.name or "") or f"{index + 1:04d}"
+            if name in names:
+                name = f"{name}_{index + 1}"
+            names.add(name)
+            z.writestr(f"{name}.{suffix}", data)
+            manifest.append({
+                "index": index,
+                "file": f"{name}.{suffix}",
+                "text": item.text,
+                "spk": param.spk,
+                "engine": param.engine,
+                "duration": round(len(wav) / sr, 3),
+                "sample_rate": sr,
+                "size": len(data),
+            })
+        z.writestr("manifest.json", json.dumps({
+            "count": len(manifest),
+            "format": suffix,
+            "duration": round(sum(item["duration"] for item in manifest), 3),
+            "items": manifest,
+        }, ensure_ascii=False, indent=2))
+    return buffer.getvalue()
+
+
+@app.post("/batch", description="批量合成多条短文本，返回zip，内含manifest.json", tags=["语音合成"],
+          dependencies=dependencies)
+async def tts_batch(request: Request, req: BatchRequest):
+    items = [BatchItem(text=item) if isinstance(item, str) else item for item in req.items or []]
+    if not items:
+        return {"code": 2, "msg": "items不能为空"}
+    if len(items) > cfg.get(cfg.batch_max_items):
+        return {"code": 2, "msg": f"一次最多{cfg.get(cfg.batch_max_items)}条"}
+    suffix = req.format.value
+    if suffix != "wav" and suffix not in ENCODERS:
+        return {"code": 2, "msg": "批量合成只支持wav/ogg/silk"}
+    shared = req.dict(exclude={"items"})
+    params = []
+    try:
+        for item in items:
+            param = Params(**{**shared, **item.params, "text": item.text})
+            resolve_speaker(param)
+            params.append(param)
+    except Exception as e:
+        return {"code": 2, "msg": f"{e}"}
+    if any(param.engine not in tts_infer._engine for param in params):
+        return {"code": 2, "msg": "引擎没启用"}
+    current_ticket.set(classify(request.headers, request.client.host if request.client else "",
+                                "".join(item.text for item in items)))
+    if overloaded():
+        return busy_response()
+    token = CancelToken()
+
+    async def run():
+        current_token.set(token)
+        with span("batch", items=len(items)):
+            results = await tts_infer.synthesize_batch([param.dict() for param in params])
+            with span("pack", format=suffix):
+                return await asyncio.to_thread(pack_batch, items, params, results, suffix)
+
+    task = asyncio.ensure_future(run())
+    try:
+        content = await wait_request(request, task, request_deadline(request, req.deadline))
+    except InferCancelled as e:
+        token.cancel(e.reason)
+        logger.info(f"放弃批量合成: {e}")
+        return cancelled_response(e)
+    except Exception as e:
+        return {"code": 2, "msg": f"{e}"}
+    response = await audio_response(request, "application/zip", content=content,
+                                    cacheable=all(param.seed != -1 for param in params))
+    response.headers["Content-Disposition"] = 'attachment; filename="batch.zip"'
+    return response
+
+
+@app.post("/jobs", description="提交长文本批量任务", tags=["批量任务"], dependencies=dependencies)
+async def job_submit(params: JobRequest):
+    resolve_speaker(params)
+    texts = params.texts or [params.text or ""]
+    if params.engine not in tts_infer._engine:
+        return {"code": 2, "msg": f"{params.engine}引擎没启用"}
+    job = job_manager.submit(params.dict(exclude={"texts"}), texts)
+    return {"code": 0, **job_manager.status(job["id"])}
+
+
+@app.get("/jobs/{job_id}", description="查询任务进度", tags=["批量任务"], dependencies=dependencies)
+async def job_status(job_id: str):
+    if job_id not in job_manager.jobs:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return {"code": 0, **job_manager.status(job_id)}
+
+
+@app.get("/jobs/{job_id}/result", description="下载任务结果，type为wav或zip", tags=["批量任务"],
+         dependencies=dependencies)
+async def job_result(request: Request, job_id: str, type: str = "wav"):
+    if job_id not in job_manager.jobs:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    if job_manager.jobs[job_id]["state"] != JobState.done:
+        return {"code": 1, "msg": "任务未完成", **job_manager.status(job_id)}
+    path = await asyncio.to_thread(job_manager.result, job_id, "zip" if type == "zip" else "wav")
+    response = await audio_response(request, "application/zip" if type == "zip" else "audio/wav", path=path,
+                                    cacheable=True, ranges=True)
+    response.headers["Content-Disposition"] = f'attachment; filename="{os.path.basename(path)}"'
+    return response
+
+
+@app.websocket("/ws")
+async def tts_ws(websocket: WebSocket, params: Params = Depends(Params)):
+    """
+    增量合成会话：发音人和参数在连接时解析一次。
+    客户端发送文本增量（纯文本或 {"text": "...", "event": "flush|end"}），
+    服务端每凑齐一句就返回 {"event": "sentence"} 和一帧16bit PCM音频。
+    """
+    await websocket.accept()
+    resolve_speaker(params)
+    current_ticket.set(classify(websocket.headers, websocket.client.host if websocket.client else "", ""))
+    token = CancelToken()
+    current_token.set(token)
+    try:
+        ctx = await tts_infer.prepare(params.dict(), params.engine)
+        sample_rate = tts_infer._engine[params.engine].sample_rate
+    except Exception as e:
+        await websocket.send_json({"event": "error", "msg": f"{e}"})
+        await websocket.close()
+        return
+    await websocket.send_json({"event": "ready", "sample_rate": sample_rate, "format": "pcm_s16le"})
+
+    sentences = asyncio.Queue()
+    # 整个会话共用：只去掉第一句开头的静音，增益由第一句决定，句间停顿和音量保持一致
+    finisher = StreamFinisher(sample_rate, **ctx.finish)
+
+    async def synthesize():
+        while (sentence := await sentences.get()) is not None:
+            try:
+                text = normalize_text(sentence) if params.normalize else sentence
+                wav = (await tts_infer.generate([text], ctx, params.engine))[0]
+                if finisher:
+                    wav = await asyncio.to_thread(finisher.process, wav)
+            except Exception as e:
+                logger.error(e)
+                await websocket.send_json({"event": "error", "msg": f"{e}", "text": sentence})
+                continue
+            await websocket.send_json({"event": "sentence", "text": sentence, "samples": len(wav)})
+            await websocket.send_bytes(to_pcm16(wav))
+        await websocket.send_json({"event": "end"})
+
+    worker = asyncio.create_task(synthesize())
+    # 断开时worker可能已经因发送失败结束，取走异常避免未处理异常的日志
+    worker.add_done_callback(lambda task: task.cancelled() or task.exception())
+    buffer = ""
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("text") is None:
+                await websocket.send_json({"event": "error", "msg": "只支持文本消息"})
+                continue
+            message = message["text"]
+            event = None
+            try:
+                data = json.loads(message)
+            except ValueError:
+                data = message
+            if isinstance(data, dict):
+                event = data.get("event")
+                message = data.get("text") or ""
+            buffer += message
+            done, buffer = split_sentences(buffer)
+            for sentence in done:
+                sentences.put_nowait(sentence)
+            if event in ("flush", "end"):
+                done, _ = split_sentences(buffer + "\n")
+                for sentence in done:
+                    sentences.put_nowait(sentence)
+                buffer = ""
+            if event == "end":
+                break
+        sentences.put_nowait(None)
+        await worker
+        await websocket.close()
+    except WebSocketDisconnect:
+        logger.debug("websocket 已断开")
+        token.cancel(CancelReason.disconnected)
+        worker.cancel()
+    except Exception as e:
+        # 发送途中断开等异常会从worker里抛出来
+        logger.debug(f"websocket 会话结束: {e}")
+        token.cancel(CancelReason.closed)
+        worker.cancel()
 
 
 async def start_api():
@@ -210,4 +730,12 @@ if __name__ == "__main__":
     # http_api = HTTPAPIThread()
     # http_api.start()
     # QtAsyncio.run()
-    asyncio.run(HTTPAPIThread().start_server())
+    import argparse
+
+    parser = argparse.ArgumentParser(description="WebTTS3 HTTP API")
+    parser.add_argument("--host", default=cfg.get(cfg.host))
+    parser.add_argument("--port", type=int, default=cfg.get(cfg.port), help="本地起多个后端时用不同端口")
+    args = parser.parse_args()
+    server = HTTPAPIThread()
+    server.host, server.port = args.host, args.port
+    asyncio.run(server.start_server())
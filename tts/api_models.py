@@ -65,7 +65,7 @@ class Params(BaseModel):
     role: Optional[str] = Query(
         "", description="角色,不设置走默认的", title="角色"
     )
-    engine: Optional[str] = Query("GPT-SoVITS", description="引擎名，默认是GPT-SoVITS", title="引擎")
+    engine: Optional[str] = Query("ChatTTS", description="引擎名，默认是ChatTTS", title="引擎")
     speed: float = Query(1.0, description="语速", title="语速")
     format: AudioFormat = Query(
         AudioFormat.wav, description="输出文件格式", title="输出音频格式"
@@ -96,7 +96,41 @@ class Params(BaseModel):
     parallel_infer: bool = Query(False, description="是否启用并行推理")
     repetition_penalty: float = Query(1.35, description="重复惩罚")
     pitch: float = Query(1.0, description="音高")
+    loudness: float = Query(0, description="响度归一化目标(LUFS)，如-16，0为不处理")
+    trim_silence: bool = Query(False, description="是否去掉首尾静音")
     local: bool = Query(False, description="是否为本地文件")
+    normalize: bool = Query(True, description="是否把数字、日期、单位等转成中文读法")
+    deadline: float = Query(0, description="最长等待秒数，超过后放弃合成，0为不限制")
+    profile: bool = Query(False, description="采样分析本次请求，返回collapsed格式的调用栈而不是音频")
+
+
+class JobRequest(Params):
+    texts: Union[List[str], None] = Query(None, description="文本列表，设置后忽略text")
+
+
+class BatchItem(BaseModel):
+    text: str = Query("", description="文本内容")
+    name: Union[str, None] = Query(None, description="zip里的文件名，不设置按序号")
+    params: dict = Query({}, description="只对这一条生效的参数，覆盖公共参数")
+
+
+class BatchRequest(Params):
+    items: List[Union[str, BatchItem]] = Query([], description="文本列表，可以是字符串或带参数的对象")
+
+
+class WarmUpRequest(BaseModel):
+    phrases: Union[List[str], None] = Query(None, description="要预热的文本，不设置读warmup_dir下的txt")
+    speakers: Union[List[str], None] = Query(None, description="发音人列表，不设置用warmup_speakers")
+    formats: Union[List[AudioFormat], None] = Query(None, description="格式列表，不设置用warmup_formats")
+    params: Union[dict, None] = Query(None, description="公共参数，不设置用warmup_params")
+
+
+class RegisterSpeaker(BaseModel):
+    name: Union[str, None] = Query(None, description="发音人名称，不设置按音频哈希生成")
+    engine: str = Query("ChatTTS", description="引擎名")
+    ref_wav_path: Union[str, None] = Query(None, description="服务器上的参考音频路径")
+    audio: Union[str, None] = Query(None, description="base64编码的参考音频，和ref_wav_path二选一")
+    prompt_text: Union[str, None] = Query(None, description="参考音频对应的文本")
 
 
 class VersionResp(BaseModel):
@@ -161,3 +195,6 @@ class VoicerGroup(BaseModel):
 
 class SSMLRequest(BaseModel):
     ssml: str = Query("", description="ssml文本")
+    spk: Union[str, None] = Query(None, description="默认发音人，<voice>里的优先")
+    seed: int = Query(-1, description="随机种子，-1为不固定")
+    deadline: float = Query(0, description="最长等待秒数，超过后放弃合成，0为不限制")
@@ -0,0 +1,183 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from loguru import logger
+
+from WebTTS3.app.common.config import cfg
+
+# 每批淘汰的条目数，以及最近多少秒内读过的条目不淘汰
+EVICT_BATCH = 64
+EVICT_GRACE = 60
+
+SUFFIXES = {"audio/wav": "wav", "audio/mpeg": "mp3", "audio/ogg": "ogg", "audio/silk": "silk"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    digest TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    file TEXT NOT NULL,
+    media_type TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    atime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_atime ON entries(atime);
+"""
+
+
+class ResultCache:
+    """
+    合成结果缓存：请求键 -> output_dir/cache 下的音频文件，相同参数的请求直接返回文件不再合成。
+    索引存在同目录的SQLite（WAL模式）里，重启后仍然有效；超过cache_max_size时按最近访问时间淘汰。
+    """
+
+    def __init__(self, directory: str):
+        self.dir = os.path.join(directory, "cache")
+        os.makedirs(self.dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.db = sqlite3.connect(os.path.join(self.dir, "index.db"), check_same_thread=False,
+                                  isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.total = 0
+        self.reconcile()
+
+    @staticmethod
+    def digest(key: str) -> str:
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def _path(self, file: str) -> str:
+        return os.path.join(self.dir, file)
+
+    def reconcile(self):
+        """ 启动时核对索引和磁盘：文件没了的删记录，大小不对的更新，没有记录的文件和残留的临时文件删掉 """
+        with self.lock:
+            indexed = set()
+            removed = fixed = 0
+            for digest, file, size in self.db.execute("SELECT digest, file, size FROM entries").fetchall():
+                path = self._path(file)
+                if not os.path.exists(path):
+                    self.db.execute("DELETE FROM entries WHERE digest=?", (digest,))
+                    removed += 1
+                    continue
+                indexed.add(file)
+                if os.path.getsize(path) != size:
+                    self.db.execute("UPDATE entries SET size=? WHERE digest=?", (os.path.getsize(path), digest))
+                    fixed += 1
+            orphans = 0
+            for name in os.listdir(self.dir):
+                if name.startswith("index.db") or name in indexed:
+                    continue
+                try:
+                    os.remove(self._path(name))
+                    orphans += 1
+                except OSError:
+                    pass
+            self.total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if removed or fixed or orphans:
+            logger.info(f"结果缓存核对：删除{removed}条失效记录，更新{fixed}条大小，清理{orphans}个无索引文件")
+        self.evict()
+
+    def get(self, key: str):
+        """ 命中返回条目dict(path/media_type/size)，文件被删了也算没命中 """
+        digest = self.digest(key)
+        with self.lock:
+            row = self.db.execute("SELECT key, file, media_type, size FROM entries WHERE digest=?",
+                                  (digest,)).fetchone()
+            if row is not None and (row[0] != key or not os.path.exists(self._path(row[1]))):
+                if row[0] == key:
+                    self.db.execute("DELETE FROM entries WHERE digest=?", (digest,))
+                    self.total -= row[3]
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.db.execute("UPDATE entries SET hits=hits+1, atime=? WHERE digest=?", (time.time(), digest))
+        return {"path": self._path(row[1]), "media_type": row[2], "size": row[3]}
+
+    def __contains__(self, key: str):
+        with self.lock:
+            row = self.db.execute("SELECT key, file FROM entries WHERE digest=?", (self.digest(key),)).fetchone()
+        return row is not None and row[0] == key and os.path.exists(self._path(row[1]))
+
+    def put(self, key: str, media_type: str, content: bytes = None, path: str = None):
+        """ 内容和文件二选一，文件是复制进缓存目录的，原文件不动 """
+        digest = self.digest(key)
+        file = f"{digest}.{SUFFIXES.get(media_type, 'bin')}"
+        target = self._path(file)
+        tmp = f"{target}.{threading.get_ident()}.tmp"
+        try:
+            if content is not None:
+                with open(tmp, "wb") as f:
+                    f.write(content)
+            else:
+                shutil.copyfile(path, tmp)
+            os.replace(tmp, target)
+        except OSError as e:
+            logger.error(f"写入结果缓存失败: {e}")
+            return None
+        size = os.path.getsize(target)
+        now = time.time()
+        with self.lock:
+            old = self.db.execute("SELECT size FROM entries WHERE digest=?", (digest,)).fetchone()
+            self.db.execute("INSERT OR REPLACE INTO entries(digest, key, file, media_type, size, hits, created, atime) "
+                            "VALUES (?, ?, ?, ?, ?, 0, ?, ?)", (digest, key, file, media_type, size, now, now))
+            self.total += size - (old[0] if old else 0)
+        self.evict()
+        return {"path": target, "media_type": media_type, "size": size}
+
+    def evict(self):
+        """
+        超过磁盘预算时按最近访问时间从旧到新删除，每次只取EVICT_BATCH条，删够为止。
+        EVICT_GRACE秒内读过的条目不删，get()刚返回的文件可能还在发送。
+        """
+        budget = int(cfg.get(cfg.cache_max_size)) * 2 ** 20
+        if budget <= 0 or self.total <= budget:
+            return
+        while self.total > budget:
+            with self.lock:
+                now = time.time()
+                rows = self.db.execute("SELECT digest, file, size FROM entries WHERE atime<? ORDER BY atime LIMIT ?",
+                                       (now - EVICT_GRACE, EVICT_BATCH)).fetchall()
+                if not rows:
+                    # 剩下的都是最近读过的，下次put时再删
+                    return
+                for digest, file, size in rows:
+                    if self.total <= budget:
+                        return
+                    try:
+                        os.remove(self._path(file))
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        logger.warning(f"删除缓存文件失败: {e}")
+                        # 推后访问时间，避免下一批又取到它
+                        self.db.execute("UPDATE entries SET atime=? WHERE digest=?", (now, digest))
+                        continue
+                    self.db.execute("DELETE FROM entries WHERE digest=?", (digest,))
+                    self.total -= size
+                    self.evicted += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        with self.lock:
+            entries = self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {
+            "entries": entries,
+            "bytes": self.total,
+            "budget_bytes": int(cfg.get(cfg.cache_max_size)) * 2 ** 20,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0,
+            "evicted": self.evicted,
+        }
@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+from contextvars import ContextVar
+from enum import Enum
+
+
+class CancelReason(str, Enum):
+    cancelled = "已取消"
+    disconnected = "客户端已断开"
+    deadline = "超过截止时间"
+    abandoned = "请求已全部取消"
+    closed = "会话异常结束"
+
+
+class InferCancelled(Exception):
+    def __init__(self, reason: CancelReason = CancelReason.cancelled):
+        super().__init__(reason.value)
+        self.reason = reason
+
+
+class CancelToken:
+    """ 跨线程的取消标记，引擎在段落之间/解码过程中检查 """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self.reason = CancelReason.cancelled
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: CancelReason = CancelReason.cancelled):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def check(self):
+        if self._event.is_set():
+            raise InferCancelled(self.reason)
+
+    def on_cancel(self, callback):
+        """ 注册取消时的回调（如中断模型解码），返回注销函数 """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def wait(self, timeout: float) -> bool:
+        """ 可被取消打断的sleep，返回是否已取消 """
+        return self._event.wait(timeout)
+
+
+current_token: ContextVar[CancelToken] = ContextVar("current_token", default=None)
+
+
+def check_cancelled():
+    token = current_token.get()
+    if token is not None:
+        token.check()
+
+
+async def wait_request(request, task: asyncio.Future, timeout: float = 0, interval: float = 0.5):
+    """ 等待任务完成；客户端断开或超过timeout秒则取消任务并抛InferCancelled """
+    deadline = time.monotonic() + timeout if timeout and timeout > 0 else None
+    try:
+        while True:
+            wait = interval if deadline is None else max(min(interval, deadline - time.monotonic()), 0)
+            done, _ = await asyncio.wait({task}, timeout=wait)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise InferCancelled(CancelReason.disconnected)
+            if deadline is not None and time.monotonic() >= deadline:
+                raise InferCancelled(CancelReason.deadline)
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+async def run_to_end(aw):
+    """
+    等待aw执行完再返回；期间被取消时也要等它真正结束才抛CancelledError。
+    线程里的推理没法强行停下，这样调用方持有的推理名额和引擎不会在线程还在跑时就被下一个请求拿走。
+    """
+    task = asyncio.ensure_future(aw)
+    cancelled = False
+    while not task.done():
+        try:
+            await asyncio.wait({task})
+        except asyncio.CancelledError:
+            cancelled = True
+    if cancelled:
+        if not task.cancelled():
+            task.exception()
+        raise asyncio.CancelledError()
+    return task.result()
@@ -1,44 +1,205 @@
 import asyncio
+import hashlib
+import io
 import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict
 from pathlib import Path
 
 import ChatTTS
+from ChatTTS.utils import select_device
 
 from PySide6.QtCore import QObject
 
 from WebTTS3.app.common.audio import load_audio
 from WebTTS3.app.common.config import cfg
+import numpy as np
 import torch
 import torchaudio
 
 from WebTTS3.app.common.Singleton import Singleton
+from WebTTS3.tts.cancel import current_token, check_cancelled
+from WebTTS3.tts.trace import span
+from WebTTS3.tts.registry import rss
+from WebTTS3.tts.engine.weights import empty_weights, ensure_safetensors, load_mapped
+from WebTTS3.tts.speakers import open_store
 from loguru import logger
 import tempfile, os
 
 
+# load_mapped设置到chat上的属性，失败时删掉再走chat.load
+MODULES = ("vocos", "dvae", "embed", "gpt", "speaker", "decoder", "tokenizer")
+
+
 @Singleton
 class ChatTTSEngine(QObject):
     def __init__(self):
         super().__init__()
         self.chat = ChatTTS.Chat()
-        self.chat.load(custom_path=cfg.get(cfg.chattts_model), source="custom")
+        self.loaded = False
         self.model_dir = os.path.join(cfg.model_dir.value, "ChatTTS")
         os.makedirs(self.model_dir, exist_ok=True)
         self.speaker = {}
+        self.store = open_store(self.model_dir)
+        self.samples = OrderedDict()  # (音频哈希, 采样率) -> spk_smp
+        self.samples_lock = threading.Lock()  # prepare在推理名额之外执行，多个线程会同时读写
+        # chat.infer不能并发，chat.interrupt作用于整个Chat实例，只允许打断当前这次推理
+        self.infer_lock = threading.Lock()
+        self.running_lock = threading.Lock()
+        self.running = None
+
+    def load(self):
+        """ 由EngineLifecycle串行调用，构造时不加载权重 """
+        if self.loaded:
+            return
+        model_path = cfg.get(cfg.chattts_model)
+        before = rss()
+        start = time.perf_counter()
+        mode = None
+        if cfg.get(cfg.chattts_mmap) and select_device().type == "cpu":
+            try:
+                converted = self.load_mapped(model_path)
+                mode = f"mmap，{converted}个张量转换了dtype" if converted else "mmap"
+            except Exception as e:
+                logger.warning(f"ChatTTS mmap加载失败，改用常规加载: {e}")
+                for attr in MODULES:
+                    if hasattr(self.chat, attr):
+                        delattr(self.chat, attr)
+        if mode is None:
+            self.chat.load(custom_path=model_path, source="custom")
+            mode = "常规"
+        self.loaded = True
+        logger.info(f"ChatTTS 加载完成（{mode}），耗时{time.perf_counter() - start:.2f}s，"
+                    f"RSS {before / 2 ** 20:.0f}MB -> {rss() / 2 ** 20:.0f}MB")
+
+    def load_mapped(self, model_path) -> int:
+        """
+        代替chat.load，只用于CPU：各模块（GPT也是）在meta设备上构建，不分配、不初始化权重，
+        再把safetensors文件的只读mmap直接赋给参数，权重不进进程私有内存，多个进程共享同一份page cache。
+        .pt/.bin权重第一次加载时转换成safetensors；不做chat.load的整包sha256校验。返回转换了dtype的张量数
+        """
+        from vocos import Vocos
+        from vocos.pretrained import instantiate_class
+        from transformers import LlamaConfig, LlamaModel
+        from ChatTTS.model import DVAE, Embed, GPT, Speaker, Tokenizer
+
+        chat = self.chat
+        config = chat.config
+        paths = {key: os.path.join(model_path, value) for key, value in asdict(config.path).items()}
+
+        def weights(key):
+            file = ensure_safetensors(paths[key])
+            if file is None:
+                raise FileNotFoundError(f"找不到权重文件: {paths[key]}")
+            return file
+
+        files = {key: weights(key) for key in ("vocos_ckpt_path", "dvae_ckpt_path", "embed_path",
+                                               "decoder_ckpt_path", "gpt_ckpt_path")}
+        device = torch.device("cpu")
+        with empty_weights():
+            vocos = Vocos(feature_extractor=instantiate_class(args=(), init=asdict(config.vocos.feature_extractor)),
+                          backbone=instantiate_class(args=(), init=asdict(config.vocos.backbone)),
+                          head=instantiate_class(args=(), init=asdict(config.vocos.head)))
+            dvae = DVAE(decoder_config=asdict(config.dvae.decoder), encoder_config=asdict(config.dvae.encoder),
+                        vq_config=asdict(config.dvae.vq), dim=config.dvae.decoder.idim, device=device)
+            embed = Embed(config.embed.hidden_size, config.embed.num_audio_tokens, config.embed.num_text_tokens,
+                          config.embed.num_vq)
+            gpt = GPT(gpt_config=asdict(config.gpt), embed=embed, device=device, device_gpt=device,
+                      logger=chat.logger)
+            # 和GPT.load_pretrained里的LlamaModel.from_pretrained一样用目录里的config.json
+            gpt.gpt = LlamaModel._from_config(LlamaConfig.from_pretrained(paths["gpt_ckpt_path"]))
+            del gpt.gpt.embed_tokens
+            decoder = DVAE(decoder_config=asdict(config.decoder), dim=config.decoder.idim, device=device)
+        converted = 0
+        for module, key in ((vocos, "vocos_ckpt_path"), (dvae, "dvae_ckpt_path"), (embed, "embed_path"),
+                            (gpt.gpt, "gpt_ckpt_path"), (decoder, "decoder_ckpt_path")):
+            converted += load_mapped(module, files[key])
+
+        chat.device = chat.device_gpt = device
+        chat.compile = False
+        chat.vocos = vocos.eval()
+        chat.dvae = dvae.eval()
+        chat.embed = embed
+        gpt.prepare()
+        chat.gpt = gpt.eval()
+        chat.speaker = Speaker(config.gpt.hidden_size, config.spk_stat, device)
+        chat.decoder = decoder.eval()
+        chat.tokenizer = Tokenizer(paths["tokenizer_path"])
+        chat.coef = str(decoder)
+        return converted
+
+    def unload(self):
+        """ 释放模型权重，发音人等小数据保留 """
+        if self.loaded:
+            self.chat.unload()
+            with self.samples_lock:
+                self.samples.clear()
+            self.loaded = False
+
+    def sample_speaker(self, data: bytes, sr=24000) -> str:
+        """ 参考音频算spk_smp，相同音频直接用缓存 """
+        key = (hashlib.sha1(data).hexdigest(), sr)
+        with self.samples_lock:
+            if key in self.samples:
+                self.samples.move_to_end(key)
+                return self.samples[key]
+        sample_audio = load_audio(io.BytesIO(data), sr)
+        with span("sample_audio_speaker"):
+            spk_smp = self.chat.sample_audio_speaker(sample_audio)
+        with self.samples_lock:
+            self.samples[key] = spk_smp
+            while len(self.samples) > cfg.get(cfg.chattts_sample_cache):
+                self.samples.popitem(last=False)
+        return spk_smp
+
+    def register_speaker(self, data: bytes, text: str, name=None) -> str:
+        """ 注册参考音频为发音人，存到发音人库，之后用 名称__ChatTTS 调用 """
+        spk_smp = self.sample_speaker(data)
+        name = name or f"ref_{hashlib.sha1(data).hexdigest()[:12]}"
+        self.store.add(name, "smp", spk_smp, text=text)
+        self.speaker[name] = {"smp": spk_smp, "text": text}
+        return name
+
+    def load_speaker(self, name) -> dict:
+        """ 先查发音人库，再兼容旧的 名称.json """
+        if name in self.store:
+            return self.store.to_json(name)
+        with open(os.path.join(self.model_dir, f"{name}.json"), encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("spk") and data["spk"] != name:
+            # 输出旁边的json只记了库里的名称
+            return self.load_speaker(data["spk"])
+        return data
+
+    @staticmethod
+    def apply_speaker(data: dict, infer_code) -> bool:
+        """ 名称.json 格式的发音人数据写入推理参数，没有音色数据时返回False """
+        if data.get("emb"):
+            infer_code.spk_emb = data["emb"]
+            return True
+        if data.get("smp"):
+            infer_code.spk_smp = data["smp"]
+            infer_code.txt_smp = data.get("text")
+            return True
+        return False
+
+    @staticmethod
+    def speaker_of(infer_code) -> dict:
+        """ 会话实际使用的发音人，格式同 名称.json，作为prepare的speaker参数传回可还原同一音色 """
+        if infer_code.spk_emb:
+            return {"emb": infer_code.spk_emb}
+        if infer_code.spk_smp:
+            return {"smp": infer_code.spk_smp, "text": infer_code.txt_smp}
+        return {}
 
     def get_speaker(self, name=None, infer_code=None):
         if name:
             try:
                 if not self.speaker.get(name):
-                    with open(os.path.join(self.model_dir, f"{name}.json"), encoding="utf-8") as f:
-                        data = json.load(f)
-                        self.speaker[name] = data
-                if self.speaker.get(name, {}).get("emb"):
-                    infer_code.spk_emb = self.speaker[name]['emb']
-                    return infer_code
-                elif self.speaker.get(name, {}).get("smp"):
-                    infer_code.spk_smp = self.speaker[name]['smp']
-                    infer_code.txt_smp = self.speaker[name]['text']
+                    self.speaker[name] = self.load_speaker(name)
+                if self.apply_speaker(self.speaker[name], infer_code):
                     return infer_code
             except Exception as e:
                 logger.error(e)
@@ -47,7 +208,8 @@ class ChatTTSEngine(QObject):
             infer_code.spk_emb = self.chat.sample_random_speaker()
         return infer_code
 
-    async def infer(self, params: dict) -> dict:
+    def prepare(self, params: dict):
+        """ 解析发音人和推理参数，同一会话内可以复用 """
         params_infer_code = ChatTTS.Chat.InferCodeParams(
             temperature=params['temperature'],  # using custom temperature
             top_P=params['top_p'],  # top P decode
@@ -55,42 +217,84 @@ class ChatTTSEngine(QObject):
             manual_seed=None if params.get("seed") == -1 else params.get("seed"),
         )
 
-        if params.get("ref_wav_path"):
+        if params.get("speaker"):
+            # 已经解析过的发音人（任务恢复时），和之前合成的段落保持同一音色
+            self.apply_speaker(params["speaker"], params_infer_code)
+        elif params.get("ref_wav_path"):
             logger.debug(f"优先使用参考音频：{params.get('ref_wav_path')}")
             # 优先使用参考音频
-            sample_audio = load_audio(params["ref_wav_path"], 24000)
             params["spk"] = None
             params_infer_code.txt_smp = params.get("prompt_text")
-            params_infer_code.spk_smp = self.chat.sample_audio_speaker(sample_audio)
-            del sample_audio
+            params_infer_code.spk_smp = self.sample_speaker(Path(params["ref_wav_path"]).read_bytes())
         else:
-            params_infer_code = self.get_speaker(params.get('spk'),infer_code=params_infer_code)
+            with span("get_speaker", spk=params.get('spk')):
+                params_infer_code = self.get_speaker(params.get('spk'), infer_code=params_infer_code)
+        return params_infer_code
 
-        def engine_infer():
-            params_refine_text = ChatTTS.Chat.RefineTextParams(
-                prompt='[oral_2][laugh_0][break_6]',
-            )
+    def generate(self, texts, params_infer_code) -> list:
+        """ 同步推理，返回每段文本的float32波形 """
+        params_refine_text = ChatTTS.Chat.RefineTextParams(
+            prompt='[oral_2][laugh_0][break_6]',
+        )
+        # GPT解码和vocoder都在chat.infer内部完成，这里只能整体计时
+        with span("chattts.infer", segments=1 if isinstance(texts, str) else len(texts)):
+            wavs = self._infer(texts, params_refine_text, params_infer_code)
+        return [np.asarray(wav, dtype=np.float32).reshape(-1) for wav in wavs]
 
-            wavs = self.chat.infer(params["text"], params_refine_text=params_refine_text,
-                                   params_infer_code=params_infer_code, skip_refine_text=True)
+    def _interrupt(self, token):
+        with self.running_lock:
+            if self.running is token:
+                self.chat.interrupt()
+
+    def _infer(self, texts, params_refine_text, params_infer_code):
+        token = current_token.get()
+        with self.infer_lock:
+            if token is None:
+                return self.chat.infer(texts, params_refine_text=params_refine_text,
+                                       params_infer_code=params_infer_code, skip_refine_text=True)
+            # 取消时打断GPT解码循环
+            token.check()
+            with self.running_lock:
+                self.running = token
+            remove = token.on_cancel(lambda: self._interrupt(token))
+            try:
+                wavs = self.chat.infer(texts, params_refine_text=params_refine_text,
+                                       params_infer_code=params_infer_code, skip_refine_text=True)
+            finally:
+                remove()
+                with self.running_lock:
+                    self.running = None
+        token.check()
+        return wavs
+
+    async def infer(self, params: dict) -> dict:
+        params_infer_code = self.prepare(params)
+
+        def engine_infer():
+            wavs = self.generate(params["text"], params_infer_code)
 
             wavs_path = []
 
             for i in range(len(wavs)):
+                check_cancelled()
                 wav_path = tempfile.mktemp(".wav", dir=cfg.output_dir.value)
                 wavs_path.append(wav_path)
                 logger.debug(f"保存wav:{wav_path}")
                 emb_path = wav_path.replace('.wav', '.json')
-                if params_infer_code.spk_emb:
-                    with open(emb_path, 'w') as f:
-                        json.dump({"emb": params_infer_code.spk_emb}, f, indent=4)
-                elif params_infer_code.spk_smp:
-                    with open(emb_path, 'w') as f:
-                        json.dump({"smp": params_infer_code.spk_smp, "text": params_infer_code.txt_smp}, f, indent=4)
-                try:
+                with span("sidecar"):
+                    if params.get("spk") in self.store:
+                        # 库里的发音人只记名称
+                        with open(emb_path, 'w', encoding="utf-8") as f:
+                            json.dump({"spk": params["spk"]}, f, ensure_ascii=False)
+                    elif params_infer_code.spk_emb:
+                        with open(emb_path, 'w') as f:
+                            json.dump({"emb": params_infer_code.spk_emb}, f, indent=4)
+                    elif params_infer_code.spk_smp:
+                        with open(emb_path, 'w') as f:
+                            json.dump({"smp": params_infer_code.spk_smp, "text": params_infer_code.txt_smp}, f,
+                                      indent=4)
+                with span("save"):
                     torchaudio.save(wav_path, torch.from_numpy(wavs[i]).unsqueeze(0), 24000)
-                except:
-                    torchaudio.save(wav_path, torch.from_numpy(wavs[i]), 24000)
             return wavs_path
 
         wavs_path = await asyncio.to_thread(engine_infer)
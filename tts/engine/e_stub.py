@@ -0,0 +1,91 @@
+import asyncio
+import os
+import tempfile
+import time
+import zlib
+
+import numpy as np
+from PySide6.QtCore import QObject
+from loguru import logger
+
+from WebTTS3.app.common.audio import save_wav
+from WebTTS3.app.common.config import cfg
+from WebTTS3.app.common.Singleton import Singleton
+from WebTTS3.tts.cancel import current_token, check_cancelled
+from WebTTS3.tts.trace import span
+
+SAMPLE_RATE = 24000
+
+
+@Singleton
+class StubEngine(QObject):
+    """ 不依赖模型的测试引擎，相同参数总是生成相同的音频 """
+
+    def __init__(self):
+        super().__init__()
+        self.sample_rate = SAMPLE_RATE
+
+    @staticmethod
+    def _seed(*parts) -> int:
+        return zlib.crc32("\x1f".join(str(p) for p in parts).encode("utf-8"))
+
+    def synthesize(self, text: str, spk=None, seed=-1, speed=1.0) -> np.ndarray:
+        """ 按文本长度生成类语音的波形，每个字一个音节 """
+        text = text or ""
+        char_duration = float(cfg.get(cfg.stub_char_duration)) / max(float(speed or 1.0), 0.1)
+        syllable = max(int(char_duration * self.sample_rate), 1)
+        n_chars = max(len(text.strip()), 1)
+
+        rng = np.random.default_rng(self._seed(spk or "", text, seed))
+        # 发音人决定基频，文字决定每个音节的音高起伏
+        base_f0 = 90 + self._seed(spk or "") % 160
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype="<u4")[:n_chars] if text else np.zeros(1, np.uint32)
+        f0 = base_f0 * (1 + ((codes % 13).astype(np.float32) - 6) / 40)
+
+        t = np.arange(syllable, dtype=np.float32) / self.sample_rate
+        envelope = np.sin(np.pi * np.arange(syllable, dtype=np.float32) / syllable) ** 2
+        phase = 2 * np.pi * f0[:, None] * t[None, :]
+        voiced = (np.sin(phase) + 0.5 * np.sin(2 * phase) + 0.25 * np.sin(3 * phase)) / 1.75
+        wav = (voiced * envelope[None, :]).reshape(-1)
+        wav += rng.normal(0, 0.01, wav.shape[0]).astype(np.float32)
+        return (0.5 * wav).astype(np.float32)
+
+    def simulate_compute(self, n_samples: int, latency=True):
+        """ 模拟推理耗时：固定延迟 + 实时率 * 音频时长 """
+        delay = float(cfg.get(cfg.stub_rtf)) * n_samples / self.sample_rate
+        if latency:
+            delay += float(cfg.get(cfg.stub_latency))
+        token = current_token.get()
+        if token is not None:
+            token.wait(delay)
+            token.check()
+        elif delay > 0:
+            time.sleep(delay)
+
+    def prepare(self, params: dict) -> dict:
+        return {"spk": params.get("spk"), "seed": params.get("seed", -1), "speed": params.get("speed", 1.0)}
+
+    def generate(self, texts, ctx: dict) -> list:
+        if isinstance(texts, str):
+            texts = [texts]
+        wavs = []
+        with span("stub.infer", segments=len(texts)):
+            for i, text in enumerate(texts):
+                check_cancelled()
+                wav = self.synthesize(text, ctx["spk"], ctx["seed"], ctx["speed"])
+                self.simulate_compute(wav.shape[0], latency=i == 0)
+                wavs.append(wav)
+        return wavs
+
+    async def infer(self, params: dict) -> list:
+        ctx = self.prepare(params)
+
+        def engine_infer():
+            wav = self.generate(params.get("text"), ctx)[0]
+            wav_path = tempfile.mktemp(".wav", dir=cfg.output_dir.value)
+            logger.debug(f"保存wav:{wav_path}")
+            return save_wav(wav_path, wav, self.sample_rate)
+
+        os.makedirs(cfg.output_dir.value, exist_ok=True)
+        wav_path = await asyncio.to_thread(engine_infer)
+        return [1, wav_path]
@@ -0,0 +1,113 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from loguru import logger
+
+# 可以转换成safetensors的旧权重格式
+CHECKPOINT_SUFFIXES = (".pt", ".pth", ".bin")
+
+_empty_lock = threading.Lock()
+
+
+@contextmanager
+def empty_weights():
+    """
+    本线程里新建的模块参数直接放到meta设备上，不分配内存也不初始化，之后由load_mapped从文件赋值。
+    buffer照常创建，rotary的inv_freq、梅尔滤波器这类不在权重文件里的也能正常使用。
+    只替换本线程的register_parameter，其它线程这期间新建的模块不受影响。
+    """
+    import torch
+
+    owner = threading.get_ident()
+    with _empty_lock:
+        original = torch.nn.Module.register_parameter
+
+        def register_parameter(module, name, param):
+            original(module, name, param)
+            if param is not None and threading.get_ident() == owner and param.device.type != "meta":
+                cls = type(module._parameters[name])
+                kwargs = {**module._parameters[name].__dict__, "requires_grad": param.requires_grad}
+                module._parameters[name] = cls(module._parameters[name].to("meta"), **kwargs)
+
+        torch.nn.Module.register_parameter = register_parameter
+        try:
+            yield
+        finally:
+            torch.nn.Module.register_parameter = original
+
+
+def ensure_safetensors(path: str):
+    """
+    path是.safetensors文件，或HF模型目录（里面的model.safetensors）。
+    不存在但有同名的.pt/.pth/.bin（目录里是pytorch_model.bin）时转换一次，以后直接mmap。
+    返回safetensors文件路径，都没有时返回None
+    """
+    if os.path.isdir(path):
+        target = os.path.join(path, "model.safetensors")
+        sources = [os.path.join(path, "pytorch_model.bin")]
+    else:
+        base = os.path.splitext(path)[0]
+        target = base + ".safetensors"
+        sources = [base + suffix for suffix in CHECKPOINT_SUFFIXES]
+    if os.path.isfile(target):
+        return target
+    source = next((s for s in sources if os.path.isfile(s)), None)
+    if source is None:
+        return None
+    convert_checkpoint(source, target)
+    return target
+
+
+def convert_checkpoint(source: str, target: str):
+    """ torch.save的权重转成safetensors，共享存储的张量各存一份，先写临时文件再替换 """
+    import torch
+    from safetensors.torch import save_file
+
+    start = time.perf_counter()
+    try:
+        state = torch.load(source, map_location="cpu", weights_only=True, mmap=True)
+    except RuntimeError:
+        # 旧的非zip格式不支持mmap
+        state = torch.load(source, map_location="cpu", weights_only=True)
+    for key in ("state_dict", "model"):
+        if isinstance(state.get(key), dict):
+            state = state[key]
+    tensors, seen = {}, set()
+    for key, tensor in state.items():
+        if not isinstance(tensor, torch.Tensor):
+            continue
+        storage = tensor.untyped_storage().data_ptr()
+        tensors[key] = tensor.contiguous() if storage not in seen else tensor.clone().contiguous()
+        seen.add(storage)
+    tmp = f"{target}.{os.getpid()}.tmp"
+    save_file(tensors, tmp, metadata={"format": "pt"})
+    os.replace(tmp, target)
+    logger.info(f"{source}已转换为{target}，耗时{time.perf_counter() - start:.1f}s")
+
+
+def load_mapped(module, path: str) -> int:
+    """
+    把safetensors文件的只读mmap张量直接赋给模块（load_state_dict(assign=True)），权重不复制，
+    多个进程共享同一份page cache。文件里没有的只允许是已经创建好的buffer，meta参数缺失时报错；
+    HF的CausalLM权重带model.前缀也能对上。dtype和模块不一致的张量会转换（转换的不共享），返回转换的个数。
+    """
+    from safetensors.torch import load_file
+
+    state = load_file(path, device="cpu")
+    mapped, converted = {}, 0
+    for key, tensor in module.state_dict().items():
+        value = state.get(key, state.get(f"model.{key}"))
+        if value is None:
+            if tensor.is_meta:
+                raise KeyError(f"{path}中没有{key}")
+            continue
+        if value.shape != tensor.shape:
+            raise ValueError(f"{path}中{key}的形状{tuple(value.shape)}和模块{tuple(tensor.shape)}不一致")
+        if value.dtype != tensor.dtype:
+            value = value.to(tensor.dtype)
+            converted += 1
+        mapped[key] = value
+    module.load_state_dict(mapped, strict=False, assign=True)
+    return converted
@@ -1,10 +1,14 @@
+import asyncio
+import importlib
 import json
 import os.path
 import pathlib
 import re
 import tempfile
 import traceback
+from dataclasses import dataclass, field
 
+import numpy as np
 from PySide6.QtCore import QObject, Signal, Slot, QDir
 from pydub import AudioSegment
 import copy
@@ -17,13 +21,25 @@ pinyin = None
 from loguru import logger
 from WebTTS3.app.common.config import cfg
 from WebTTS3.tts import load_ext
+from WebTTS3.tts.text import segment_text, normalize_text
+from WebTTS3.app.common.audio import WavWriter, postprocess, finish_audio, StreamFinisher, LoudnessMeter, scale_wav
+from WebTTS3.app.common.trie import SearchIndex
+from WebTTS3.tts.scheduler import scheduler
+from WebTTS3.tts.cancel import check_cancelled, run_to_end
+from WebTTS3.tts.trace import span
+from WebTTS3.tts.registry import EngineRegistry
+from WebTTS3.tts.speakers import open_store
 
 
 class BaseInfer(QObject):
     configChanged = Signal(dict, str, arguments=["config", "type"])
     inferResult = Signal(int, str, arguments=["code", "data"])
+    engine = None
+    sample_rate = 24000
+    native_params = ()  # 引擎自己已经处理的后处理参数，合成后不再重复处理
 
-    def clean_filename(self, filename):
+    @staticmethod
+    def clean_filename(filename):
         # 特殊字符列表，可以根据需要添加或删除字符
         special_chars = ['/', '\\', "\n", ':', '*', '?', '"', '<', '>', '|', '\0']
 
@@ -45,21 +61,56 @@ class BaseInfer(QObject):
     def synthesis(self):
         return {}
 
+    def load(self):
+        """ 加载模型，由EngineRegistry在第一次使用时调用 """
+        pass
+
+    def unload(self):
+        """ 释放模型占用的内存 """
+        self.engine = None
+
+    def prepare(self, params: dict):
+        return self.engine.prepare(params)
+
+    def generate(self, texts: list, ctx) -> list:
+        return self.engine.generate(texts, ctx)
+
+    def speaker_of(self, ctx) -> dict:
+        """ prepare解析出的发音人，可以存下来通过参数speaker还原；引擎不需要时为空 """
+        return self.engine.speaker_of(ctx) if hasattr(self.engine, "speaker_of") else {}
+
+    def register_speaker(self, data: bytes, text: str, name=None) -> str:
+        if not hasattr(self.engine, "register_speaker"):
+            raise ValueError("该引擎不支持注册参考音频")
+        return self.engine.register_speaker(data, text, name)
+
 
 class ChatTTSInfer(BaseInfer):
     def __init__(self):
         super().__init__()
         self.config = {}
+
+    def load(self):
         from WebTTS3.tts.engine.e_chattts import ChatTTSEngine
         self.engine = ChatTTSEngine()
+        self.engine.load()
+
+    def unload(self):
+        if self.engine:
+            self.engine.unload()
+        self.engine = None
 
     async def get_config(self):
         data = {"": {}}
         model_dir = os.path.join(cfg.model_dir.value, "ChatTTS")
         os.makedirs(model_dir, exist_ok=True)
         for file_info in QDir(model_dir).entryInfoList(QDir.NoDotAndDotDot | QDir.Files):
-            if file_info.fileName().endswith(".json"):
+            if file_info.fileName().endswith(".json") and file_info.fileName() != "speakers.json":
                 data[file_info.fileName()[:-5]] = {}
+        store = open_store(model_dir)
+        for name in store.names():
+            meta = store.meta[name]
+            data[name] = {k: meta[k] for k in ("avatar", "desc", "tags") if meta[k]}
         self.configChanged.emit(data, "ChatTTS")
         return data
 
@@ -67,6 +118,36 @@ class ChatTTSInfer(BaseInfer):
         return await self.engine.infer(params=params)
 
 
+class StubInfer(BaseInfer):
+    native_params = ("speed",)
+
+    def load(self):
+        from WebTTS3.tts.engine.e_stub import StubEngine
+        self.engine = StubEngine()
+
+    async def get_config(self):
+        data = {"": {}}
+        for i in range(int(cfg.get(cfg.stub_speakers))):
+            data[f"stub_{i}"] = {"desc": "Stub测试发音人"}
+        self.configChanged.emit(data, "Stub")
+        return data
+
+    async def infer(self, params: dict):
+        return await self.engine.infer(params=params)
+
+
+@dataclass
+class Session:
+    """
+    TTSInfer.prepare的结果：引擎的会话参数，每段合成后的变速变调参数，实际使用的发音人，
+    以及拼好整段输出后才做的去静音/响度参数（finish）
+    """
+    ctx: object
+    post: dict = field(default_factory=dict)
+    speaker: dict = field(default_factory=dict)
+    finish: dict = field(default_factory=dict)
+
+
 class TTSInfer(QObject):
     configChanged = Signal(dict, arguments=["config"])
     inferResult = Signal(int, str, arguments=["code", "data"])
@@ -77,6 +158,7 @@ class TTSInfer(QObject):
     def __init__(self):
         super().__init__()
         self._voicers = {}
+        self._index = {}
         self._speakers = {}
         self._duration = 0
 
@@ -85,6 +167,19 @@ class TTSInfer(QObject):
         if cfg.get(cfg.chattts_enable):
             logger.debug("ChatTTS 引擎已启用")
             self._engine["ChatTTS"] = ChatTTSInfer()
+        if cfg.get(cfg.stub_enable):
+            logger.debug("Stub 测试引擎已启用")
+            self._engine["Stub"] = StubInfer()
+        for engineName, classPath in cfg.get(cfg.engine_classes).items():
+            # 配置里声明的其它引擎，格式为 模块路径:类名
+            try:
+                module, _, className = classPath.partition(":")
+                self._engine[engineName] = getattr(importlib.import_module(module), className)()
+                logger.debug(f"{engineName} 引擎已启用")
+            except Exception as e:
+                logger.error(f"{engineName} 引擎配置有误: {e}")
+        # 模型按需加载，这里只创建轻量的引擎对象
+        self._registry = EngineRegistry(self._engine)
         for engineName in self._engine:
             if self._engine[engineName]:
                 self._engine[engineName].configChanged.connect(self.parseConfig)
@@ -107,6 +202,7 @@ class TTSInfer(QObject):
                     "engine": engineName
                 }
             )
+        self._index[engineName] = SearchIndex(config)
         self.configChanged.emit(config)
 
     async def get_config(self, engineName="Azure"):
@@ -127,18 +223,172 @@ class TTSInfer(QObject):
     @Slot(str, str, result=list)
     def voicers(self, keyword=None, engineName="ChatTTS") -> list:
         if keyword:
-            searchList = []
-            for _, voicer in enumerate(self._voicers.get(engineName, [])):
-                if keyword in voicer["name"]:
-                    searchList.append(voicer)
-            return searchList
+            index = self._index.get(engineName)
+            if index is None:
+                return []
+            voicers = self._voicers[engineName]
+            return [voicers[i] for i in index.search(keyword)]
         # logger.debug(f'voicers called: {keyword}, {engineName} result: {self._voicers.get(engineName, [])}')
         return self._voicers.get(engineName, [])
 
     async def infer(self, args, engineName):
         logger.debug(f'infer called: {engineName}, {args}')
-
-        return await self._engine[engineName].infer(args)
+        self._normalize(args)
+        # 需要后处理的也走内存合成再写文件，不用再读一遍引擎写的文件
+        if (len(args.get("text") or "") > cfg.get(cfg.long_text_chars) or self._post_params(args, engineName)
+                or self._finish_params(args)):
+            return await self.infer_long(args, engineName)
+        with span("infer", engine=engineName, chars=len(args.get("text") or "")):
+            async with self._registry.use(engineName) as engine, scheduler.slot(len(args.get("text") or "")):
+                check_cancelled()
+                return await run_to_end(engine.infer(args))
+
+    @staticmethod
+    def _normalize(args):
+        if args.get("normalize", True):
+            args["text"] = normalize_text(args.get("text"))
+            args["normalize"] = False
+
+    async def stream(self, args, engineName, finish=True):
+        """ 在内存中按段落批量合成，逐段产出波形；finish时按StreamFinisher去首尾静音、统一增益 """
+        logger.debug(f'stream called: {engineName}, {args}')
+        self._normalize(args)
+        segments = segment_text(args["text"], cfg.get(cfg.job_segment_chars)) or [args["text"]]
+        batch_size = max(int(args.get("batch_size") or 1), 1)
+        ctx = await self.prepare(args, engineName)
+        finisher = StreamFinisher(self._engine[engineName].sample_rate, **ctx.finish) if finish else None
+        for start in range(0, len(segments), batch_size):
+            wavs = await self.generate(segments[start:start + batch_size], ctx, engineName)
+            last = start + batch_size >= len(segments)
+            for i, wav in enumerate(wavs):
+                if finisher:
+                    wav = await asyncio.to_thread(finisher.process, wav, last and i == len(wavs) - 1)
+                yield wav
+
+    async def synthesize(self, args, engineName):
+        """ 合成到内存，返回(波形, 采样率)；去静音和响度在拼好的整段上做 """
+        sr = self._engine[engineName].sample_rate
+        wav = np.concatenate([wav async for wav in self.stream(args, engineName, finish=False)])
+        finish = self._finish_params(args)
+        if finish:
+            with span("finish", **finish):
+                wav = await asyncio.to_thread(finish_audio, wav, sr, **finish)
+        return wav, sr
+
+    async def synthesize_batch(self, items: list) -> list:
+        """
+        多条短文本批量合成，items为参数字典（含engine）。参数相同的条目共用一次prepare，
+        各条切段后按batch_infer_size段一次推理，按输入顺序返回(波形, 采样率)。
+        """
+        groups = {}
+        for index, args in enumerate(items):
+            self._normalize(args)
+            key = json.dumps({k: v for k, v in args.items() if k != "text"}, sort_keys=True, default=str)
+            groups.setdefault(key, []).append(index)
+
+        size = max(int(cfg.get(cfg.batch_infer_size)), 1)
+        results = [None] * len(items)
+        for indexes in groups.values():
+            engineName = items[indexes[0]]["engine"]
+            ctx = await self.prepare(items[indexes[0]], engineName)
+            owners, segments = [], []
+            for index in indexes:
+                parts = segment_text(items[index]["text"], cfg.get(cfg.job_segment_chars)) or [items[index]["text"]]
+                owners.extend([index] * len(parts))
+                segments.extend(parts)
+            wavs = []
+            for start in range(0, len(segments), size):
+                wavs.extend(await self.generate(segments[start:start + size], ctx, engineName))
+            sr = self._engine[engineName].sample_rate
+            parts = {index: [] for index in indexes}
+            for owner, wav in zip(owners, wavs):
+                parts[owner].append(wav)
+            for index, wavs in parts.items():
+                wav = np.concatenate(wavs) if wavs else np.zeros(0, dtype=np.float32)
+                if ctx.finish:
+                    wav = await asyncio.to_thread(finish_audio, wav, sr, **ctx.finish)
+                results[index] = (wav, sr)
+        return results
+
+    async def infer_long(self, args, engineName):
+        """ 长文本流式合成：按batch_size段一批推理，直接追加到输出文件，峰值内存只和批大小有关 """
+        engine = self._engine[engineName]
+        segments = segment_text(args["text"], cfg.get(cfg.job_segment_chars))
+        batch_size = max(int(args.get("batch_size") or 1), 1)
+        ctx = await self.prepare(args, engineName)
+        wav_path = tempfile.mktemp(".wav", dir=cfg.output_dir.value)
+        logger.debug(f"长文本{len(segments)}段，流式写入:{wav_path}")
+
+        # 只去掉开头和结尾的静音；响度边写边统计，写完后整个文件乘同一个增益
+        finisher = StreamFinisher(engine.sample_rate, trim_silence=ctx.finish.get("trim_silence", False))
+        meter = LoudnessMeter(engine.sample_rate) if ctx.finish.get("loudness") else None
+
+        def write(wav, last):
+            wav = finisher.process(wav, last)
+            if meter is not None:
+                meter.add(wav)
+            writer.write(wav)
+
+        # 每批单独排队，长文本不会一直占着引擎
+        with WavWriter(wav_path, engine.sample_rate) as writer:
+            for start in range(0, len(segments), batch_size):
+                wavs = await self.generate(segments[start:start + batch_size], ctx, engineName)
+                last = start + batch_size >= len(segments)
+                for i, wav in enumerate(wavs):
+                    await asyncio.to_thread(write, wav, last and i == len(wavs) - 1)
+                del wavs
+        if meter is not None:
+            with span("finish", loudness=ctx.finish["loudness"]):
+                await asyncio.to_thread(scale_wav, wav_path, meter.gain(ctx.finish["loudness"]))
+        return [1, wav_path]
+
+    def _post_params(self, args, engineName) -> dict:
+        """ 引擎没处理、需要每段合成后在内存里处理的参数（变速变调），都是默认值时为空 """
+        native = self._engine[engineName].native_params if engineName in self._engine else ()
+        return {k: float(args[k]) for k in ("speed", "pitch")
+                if k not in native and args.get(k) is not None and abs(float(args[k]) - 1.0) >= 1e-3}
+
+    @staticmethod
+    def _finish_params(args) -> dict:
+        """ 对整段输出做的去首尾静音和响度归一化，不按段做，否则段间音量跳变、句间停顿被去掉 """
+        finish = {}
+        if args.get("loudness"):
+            finish["loudness"] = float(args["loudness"])
+        if args.get("trim_silence"):
+            finish["trim_silence"] = True
+        return finish
+
+    async def prepare(self, args, engineName) -> Session:
+        """ 解析发音人等会话级参数，返回给generate复用 """
+        with span("prepare", engine=engineName):
+            async with self._registry.use(engineName) as engine:
+                ctx = await run_to_end(asyncio.to_thread(engine.prepare, args))
+                speaker = engine.speaker_of(ctx)
+        return Session(ctx, self._post_params(args, engineName), speaker, self._finish_params(args))
+
+    async def generate(self, texts: list, session: Session, engineName) -> list:
+        """ 直接返回内存中的波形列表，不落盘 """
+        check_cancelled()
+        with span("generate", engine=engineName, segments=len(texts)):
+            async with self._registry.use(engineName) as engine, scheduler.slot(sum(len(text) for text in texts)):
+                check_cancelled()
+                # 取消后也等推理线程返回再释放名额，不然下一个请求会和它同时用同一个模型
+                wavs = await run_to_end(asyncio.to_thread(engine.generate, texts, session.ctx))
+        if session.post:
+            sr = self._engine[engineName].sample_rate
+            # 后处理只用CPU，不占推理名额
+            with span("postprocess", **session.post):
+                wavs = await asyncio.to_thread(lambda: [postprocess(wav, sr, **session.post) for wav in wavs])
+        return wavs
+
+    async def register_speaker(self, data: bytes, text: str, name=None, engineName="ChatTTS") -> str:
+        """ 注册参考音频，返回 名称__引擎 形式的发音人 """
+        if name:
+            name = BaseInfer.clean_filename(name)
+        async with self._registry.use(engineName) as engine:
+            name = await run_to_end(asyncio.to_thread(engine.register_speaker, data, text, name))
+        await self.get_config(engineName)
+        return f"{name}__{engineName}"
 
     @Slot(str, str, result=list)
     def emotions(self, voicerName, engineName="Azure"):
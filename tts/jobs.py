@@ -0,0 +1,180 @@
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+import wave
+import zipfile
+from enum import Enum
+
+import numpy as np
+from loguru import logger
+
+from WebTTS3.app.common.audio import save_wav, to_pcm16, StreamFinisher, LoudnessMeter, scale_wav
+from WebTTS3.app.common.config import cfg
+from WebTTS3.tts.scheduler import current_ticket, Ticket
+from WebTTS3.tts.text import segment_text, normalize_text
+
+
+class JobState(str, Enum):
+    pending = "pending"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+
+class JobManager:
+    """ 长文本批量合成任务，状态持久化到 output_dir/jobs/<id>/job.json，重启后从最后完成的段落继续 """
+
+    def __init__(self, tts_infer, output_dir):
+        self.tts_infer = tts_infer
+        self.root = os.path.join(output_dir, "jobs")
+        os.makedirs(self.root, exist_ok=True)
+        self.jobs = {}
+        self.tasks = {}
+        # 与交互请求分开限流
+        self.semaphore = asyncio.Semaphore(max(int(cfg.get(cfg.job_concurrency)), 1))
+
+    def job_dir(self, job_id):
+        return os.path.join(self.root, job_id)
+
+    def segment_path(self, job_id, index):
+        return os.path.join(self.job_dir(job_id), f"seg_{index:05d}.wav")
+
+    def save(self, job):
+        job["updated"] = time.time()
+        path = os.path.join(self.job_dir(job["id"]), "job.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    def resume(self):
+        """ 启动时加载已有任务，未完成的继续跑 """
+        for job_id in os.listdir(self.root):
+            path = os.path.join(self.job_dir(job_id), "job.json")
+            if not os.path.isfile(path):
+                continue
+            try:
+                with open(path, encoding="utf-8") as f:
+                    job = json.load(f)
+            except Exception as e:
+                logger.error(f"任务{job_id}状态损坏: {e}")
+                continue
+            self.jobs[job_id] = job
+            if job["state"] in (JobState.pending, JobState.running):
+                logger.info(f"恢复任务{job_id}，已完成{job['completed']}/{len(job['segments'])}")
+                self.start(job_id)
+
+    def submit(self, params: dict, texts: list) -> dict:
+        job_id = uuid.uuid4().hex
+        if params.get("seed", -1) == -1:
+            # 随机种子在提交时定下来，重启恢复后的段落和之前用同一个种子
+            params = {**params, "seed": random.randrange(2 ** 31)}
+        if params.get("normalize", True):
+            # 和TTSInfer._normalize一样，规范化后的段落落盘，恢复时不再重复处理
+            texts = [normalize_text(text) for text in texts]
+            params = {**params, "normalize": False}
+        os.makedirs(self.job_dir(job_id))
+        segments = []
+        for text in texts:
+            segments.extend(segment_text(text, int(cfg.get(cfg.job_segment_chars))))
+        job = {
+            "id": job_id,
+            "state": JobState.pending,
+            "params": params,
+            "segments": segments,
+            "completed": 0,
+            "sample_rate": None,
+            "error": "",
+            "created": time.time(),
+        }
+        self.jobs[job_id] = job
+        self.save(job)
+        self.start(job_id)
+        return job
+
+    def start(self, job_id):
+        self.tasks[job_id] = asyncio.create_task(self.run(job_id))
+
+    def status(self, job_id) -> dict:
+        job = self.jobs[job_id]
+        total = len(job["segments"])
+        return {
+            "id": job_id,
+            "state": job["state"],
+            "total": total,
+            "completed": job["completed"],
+            "progress": round(job["completed"] / total, 4) if total else 1.0,
+            "error": job["error"],
+        }
+
+    async def run(self, job_id):
+        job = self.jobs[job_id]
+        engine = job["params"]["engine"]
+        current_ticket.set(Ticket("bulk", f"job:{job_id}"))
+        async with self.semaphore:
+            job["state"] = JobState.running
+            self.save(job)
+            try:
+                args = dict(job["params"])
+                if job.get("speaker"):
+                    args["speaker"] = job["speaker"]
+                ctx = await self.tts_infer.prepare(args, engine)
+                if "speaker" not in job:
+                    # 第一次运行时记下实际使用的发音人（随机发音人也是），恢复时不再重新抽
+                    job["speaker"] = ctx.speaker
+                job["sample_rate"] = self.tts_infer._engine[engine].sample_rate
+                batch_size = max(int(job["params"].get("batch_size") or 1), 1)
+                while job["completed"] < len(job["segments"]):
+                    start = job["completed"]
+                    texts = job["segments"][start:start + batch_size]
+                    wavs = await self.tts_infer.generate(texts, ctx, engine)
+                    for i, wav in enumerate(wavs):
+                        save_wav(self.segment_path(job_id, start + i), wav, job["sample_rate"])
+                    job["completed"] = start + len(wavs)
+                    self.save(job)
+                job["state"] = JobState.done
+            except Exception as e:
+                logger.error(f"任务{job_id}失败: {e}")
+                job["state"] = JobState.failed
+                job["error"] = f"{e}"
+            self.save(job)
+            self.tasks.pop(job_id, None)
+
+    def result(self, job_id, kind="wav") -> str:
+        """ 合并成一个wav，或把所有段落打成zip """
+        job = self.jobs[job_id]
+        segments = [self.segment_path(job_id, i) for i in range(job["completed"])]
+        if kind == "zip":
+            path = os.path.join(self.job_dir(job_id), "result.zip")
+            if not os.path.isfile(path):
+                with zipfile.ZipFile(path + ".tmp", "w", zipfile.ZIP_STORED) as z:
+                    for segment in segments:
+                        z.write(segment, os.path.basename(segment))
+                os.replace(path + ".tmp", path)
+            return path
+        path = os.path.join(self.job_dir(job_id), "result.wav")
+        if not os.path.isfile(path):
+            # 段落文件保存的是原始音频，去首尾静音和响度归一化在合并后的整段上做
+            finish = self.tts_infer._finish_params(job["params"])
+            finisher = StreamFinisher(job["sample_rate"], trim_silence=finish.get("trim_silence", False))
+            meter = LoudnessMeter(job["sample_rate"]) if finish.get("loudness") else None
+            with wave.open(path + ".tmp", "wb") as out:
+                out.setnchannels(1)
+                out.setsampwidth(2)
+                out.setframerate(job["sample_rate"])
+                for i, segment in enumerate(segments):
+                    with wave.open(segment, "rb") as f:
+                        frames = f.readframes(f.getnframes())
+                    if finish:
+                        wav = np.frombuffer(frames, dtype="<i2").astype(np.float32) / 32768
+                        wav = finisher.process(wav, i == len(segments) - 1)
+                        if meter is not None:
+                            meter.add(wav)
+                        frames = to_pcm16(wav)
+                    out.writeframes(frames)
+            if meter is not None:
+                scale_wav(path + ".tmp", meter.gain(finish["loudness"]))
+            os.replace(path + ".tmp", path)
+        return path
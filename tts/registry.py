@@ -0,0 +1,292 @@
+import asyncio
+import gc
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from contextlib import asynccontextmanager
+from enum import Enum
+
+from loguru import logger
+
+from WebTTS3.app.common.config import cfg
+
+
+def rss() -> int:
+    """ 当前进程常驻内存（字节），拿不到时返回0 """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+class EngineState(Enum):
+    UNLOADED = "unloaded"
+    LOADING = "loading"
+    READY = "ready"
+    DRAINING = "draining"
+    FAILED = "failed"
+    UNLOADING = "unloading"
+
+
+class EngineLifecycle:
+    """
+    单个引擎的加载状态，线程安全：同一时间只有一个调用方真正加载，
+    其它协程都等同一个ready future；加载失败后下一次使用会重试。
+    """
+
+    def __init__(self, name, engine, load_lock=None, on_event=None):
+        self.name = name
+        self.engine = engine
+        self.state = EngineState.UNLOADED
+        self.error = None
+        self.lock = threading.Lock()
+        self.load_lock = load_lock or threading.Lock()
+        self.on_event = on_event or (lambda *args, **kwargs: None)
+        self.ready = Future()
+        self.unloaded = Future()
+        self.unloaded.set_result(False)
+        self.drained = Future()
+        self.memory = 0
+        self.loads = 0
+        self.unloads = 0
+        self.load_seconds = 0.0
+        self.inflight = 0
+        self.last_used = 0.0
+
+    def _begin(self):
+        """ 返回(要等的future, 是否由调用方负责加载) """
+        with self.lock:
+            if self.state in (EngineState.LOADING, EngineState.READY):
+                return self.ready, False
+            if self.state in (EngineState.DRAINING, EngineState.UNLOADING):
+                return self.unloaded, False
+            self.state = EngineState.LOADING
+            self.ready = Future()
+            # 置为running后等待方取消也不会取消这个future
+            self.ready.set_running_or_notify_cancel()
+            return self.ready, True
+
+    def _load(self, future: Future):
+        # 串行加载，内存差值才准确，也避免多个模型同时加载撑爆内存
+        with self.load_lock:
+            before = rss()
+            start = time.perf_counter()
+            try:
+                self.engine.load()
+            except Exception as e:
+                with self.lock:
+                    self.state = EngineState.FAILED
+                    self.error = f"{e}"
+                self.on_event(self.name, "load_failed", error=self.error)
+                future.set_exception(e)
+                return
+            seconds = time.perf_counter() - start
+            memory = max(rss() - before, 0)
+        with self.lock:
+            self.state = EngineState.READY
+            self.error = None
+            self.load_seconds = seconds
+            self.memory = memory
+            self.loads += 1
+            self.last_used = time.monotonic()
+        self.on_event(self.name, "loaded", seconds=round(seconds, 2), memory_mb=round(memory / 2 ** 20, 1))
+        future.set_result(True)
+
+    def _enter(self) -> bool:
+        with self.lock:
+            if self.state is not EngineState.READY:
+                return False
+            self.inflight += 1
+            return True
+
+    async def acquire(self):
+        """ 等到引擎就绪并占用，用完调用release """
+        while True:
+            future, owner = self._begin()
+            if owner:
+                await asyncio.to_thread(self._load, future)
+            # 等到的是卸载完成，或刚加载完又被卸载了，重新来一遍
+            if await asyncio.shield(asyncio.wrap_future(future)) and self._enter():
+                return self.engine
+
+    def release(self):
+        with self.lock:
+            self.inflight -= 1
+            self.last_used = time.monotonic()
+            if self.state is EngineState.DRAINING and not self.inflight and not self.drained.done():
+                self.drained.set_result(True)
+
+    def drain(self):
+        """ 不再接新请求，新来的等卸载完成；返回正在使用的请求都结束时完成的future，没加载时返回None """
+        with self.lock:
+            if self.state is not EngineState.READY:
+                return None
+            self.state = EngineState.DRAINING
+            self.unloaded = Future()
+            self.drained = Future()
+            if not self.inflight:
+                self.drained.set_result(True)
+            return self.drained
+
+    def undrain(self):
+        """ 放弃卸载，恢复接收请求 """
+        with self.lock:
+            if self.state is not EngineState.DRAINING:
+                return
+            self.state = EngineState.READY
+        self.unloaded.set_result(False)
+
+    def unload(self, reason="") -> bool:
+        """ 卸载空闲的引擎，正在使用或没加载时返回False """
+        with self.lock:
+            if self.state not in (EngineState.READY, EngineState.DRAINING) or self.inflight:
+                return False
+            if self.state is EngineState.READY:
+                self.unloaded = Future()
+            self.state = EngineState.UNLOADING
+        before = rss()
+        try:
+            self.engine.unload()
+            state, self.error = EngineState.UNLOADED, None
+        except Exception as e:
+            logger.error(f"{self.name} 卸载失败: {e}")
+            state, self.error = EngineState.FAILED, f"{e}"
+        gc.collect()
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        with self.lock:
+            self.state = state
+            self.unloads += 1
+        self.unloaded.set_result(False)
+        self.on_event(self.name, "unloaded", reason=reason, freed_mb=round(max(before - rss(), 0) / 2 ** 20, 1))
+        return True
+
+    def stats(self, now: float) -> dict:
+        loaded = self.state in (EngineState.READY, EngineState.DRAINING)
+        return {
+            "state": self.state.value,
+            "error": self.error,
+            "memory_mb": round(self.memory / 2 ** 20, 1) if loaded else 0,
+            "inflight": self.inflight,
+            "loads": self.loads,
+            "unloads": self.unloads,
+            "load_seconds": round(self.load_seconds, 2),
+            "idle_seconds": round(now - self.last_used, 1) if loaded else None,
+        }
+
+
+class EngineRegistry:
+    """
+    引擎模型按需加载：第一次使用时才加载模型，同时到来的请求只等同一次加载；
+    超过内存预算时按LRU卸载空闲引擎，空闲超时的引擎也会被卸载。
+    """
+
+    def __init__(self, engines: dict):
+        self.engines = engines
+        self.events = deque(maxlen=200)
+        load_lock = threading.Lock()
+        self.lifecycles = {name: EngineLifecycle(name, engine, load_lock, self._event)
+                           for name, engine in engines.items()}
+        self._reaper = None
+
+    def _event(self, name, event, **data):
+        self.events.append({"time": time.time(), "engine": name, "event": event, **data})
+        logger.info(f"{name} {event} {data}")
+
+    def resident(self) -> int:
+        return sum(lc.memory for lc in self.lifecycles.values()
+                   if lc.state in (EngineState.READY, EngineState.DRAINING))
+
+    def _lifecycle(self, name) -> EngineLifecycle:
+        if name not in self.lifecycles:
+            raise KeyError(f"{name}引擎没启用")
+        return self.lifecycles[name]
+
+    async def ensure_loaded(self, name):
+        async with self.use(name):
+            pass
+
+    async def unload(self, name, reason=""):
+        return await asyncio.to_thread(self._lifecycle(name).unload, reason)
+
+    async def reload(self, name, timeout: float = None) -> bool:
+        """
+        不重启进程重新加载模型：先停止接新请求（新请求等重新加载完成），等正在处理的请求结束后卸载再加载。
+        timeout秒内没处理完则放弃，恢复原来的模型，返回False；加载失败也返回False。
+        """
+        lifecycle = self._lifecycle(name)
+        drained = lifecycle.drain()
+        if drained is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(drained)), timeout)
+            except asyncio.TimeoutError:
+                lifecycle.undrain()
+                logger.warning(f"{name} 还有{lifecycle.inflight}个请求在处理，放弃重新加载")
+                return False
+            except asyncio.CancelledError:
+                lifecycle.undrain()
+                raise
+            await self.unload(name, reason="reload")
+        try:
+            await self.ensure_loaded(name)
+        except Exception as e:
+            logger.error(f"{name} 重新加载失败: {e}")
+            return False
+        return True
+
+    async def enforce_budget(self, keep=None):
+        budget = int(cfg.get(cfg.engine_memory_budget)) * 2 ** 20
+        if budget <= 0 or self.resident() <= budget:
+            return
+        idle = sorted((lc.last_used, name) for name, lc in self.lifecycles.items()
+                      if lc.state is EngineState.READY and not lc.inflight and name != keep)
+        for _, name in idle:
+            if self.resident() <= budget:
+                break
+            await self.unload(name, reason="memory_budget")
+
+    async def reap(self):
+        """ 定期卸载空闲超时的引擎 """
+        while True:
+            await asyncio.sleep(30)
+            timeout = float(cfg.get(cfg.engine_idle_timeout))
+            if timeout <= 0:
+                continue
+            now = time.monotonic()
+            for name, lc in self.lifecycles.items():
+                if lc.state is EngineState.READY and not lc.inflight and now - lc.last_used > timeout:
+                    await self.unload(name, reason="idle_timeout")
+
+    def start(self):
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self.reap())
+
+    @asynccontextmanager
+    async def use(self, name):
+        """ 使用期间引擎不会被卸载 """
+        lifecycle = self._lifecycle(name)
+        engine = await lifecycle.acquire()
+        try:
+            await self.enforce_budget(keep=name)
+            yield engine
+        finally:
+            lifecycle.release()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "resident_mb": round(self.resident() / 2 ** 20, 1),
+            "budget_mb": cfg.get(cfg.engine_memory_budget),
+            "engines": {name: lc.stats(now) for name, lc in self.lifecycles.items()},
+            "events": list(self.events)[-20:],
+        }
@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+import os
+import re
+
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+
+from WebTTS3.app.common.config import cfg
+
+RANGE = re.compile(r'bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def content_etag(data: bytes) -> str:
+    return '"' + hashlib.sha256(data).hexdigest()[:32] + '"'
+
+
+def key_etag(key: str) -> str:
+    """ 结果确定的请求用请求键做ETag，合成之前就能判断304 """
+    return '"k' + hashlib.sha256(key.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def file_etag(f) -> str:
+    """ 从打开的二进制文件开头算内容哈希，算完回到开头 """
+    h = hashlib.sha256()
+    f.seek(0)
+    while chunk := f.read(1024 * 1024):
+        h.update(chunk)
+    f.seek(0)
+    return '"' + h.hexdigest()[:32] + '"'
+
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in tags
+
+
+def parse_range(header: str, size: int):
+    """
+    只支持单个区间，返回(start, end)含end。没有Range、多区间或格式不对时返回None，按RFC 9110忽略Range返回完整内容；
+    区间在内容之外（无法满足）时抛ValueError
+    """
+    if not header:
+        return None
+    m = RANGE.match(header.strip())
+    if not m or not (m.group(1) or m.group(2)):
+        return None
+    if m.group(1):
+        start = int(m.group(1))
+        if m.group(2) and int(m.group(2)) < start:
+            return None
+        end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+    else:
+        start = max(size - int(m.group(2)), 0)
+        end = size - 1
+    if start > end or start >= size:
+        raise ValueError(header)
+    return start, end
+
+
+def _read_file(f, start, end):
+    with f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _headers(etag: str, cacheable: bool, ranges: bool) -> dict:
+    return {
+        "ETag": etag,
+        "Accept-Ranges": "bytes" if ranges else "none",
+        "Cache-Control": f"public, max-age={cfg.get(cfg.cache_max_age)}" if cacheable else "no-cache",
+    }
+
+
+def not_modified(request: Request, etag: str, cacheable: bool = True):
+    """ If-None-Match命中时返回304响应，否则返回None """
+    if etag_matches(etag, request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=_headers(etag, cacheable, True))
+    return None
+
+
+async def audio_response(request: Request, media_type: str, content: bytes = None, path: str = None,
+                         cacheable: bool = False, etag: str = None, ranges: bool = False) -> Response:
+    """
+    返回音频并处理缓存语义：ETag默认是内容哈希，If-None-Match命中返回304。
+    cacheable表示相同请求总是得到相同音频（固定了种子），可以让浏览器/CDN缓存。
+    ranges表示内容来自已经存下来的文件（结果缓存、任务结果），这时才支持单区间Range请求；
+    刚合成出来的音频忽略Range返回完整内容，避免每次拖动进度条都重新合成、拼出不同次合成的片段。
+    文件在这里就打开，之后被删除（如缓存淘汰）也能发完；文件已经不存在时抛出FileNotFoundError。
+    """
+    f = None
+    if content is not None:
+        etag = etag or content_etag(content)
+        size = len(content)
+    else:
+        f = open(path, "rb")
+        etag = etag or await asyncio.to_thread(file_etag, f)
+        size = os.fstat(f.fileno()).st_size
+    headers = _headers(etag, cacheable, ranges)
+    if etag_matches(etag, request.headers.get("if-none-match")):
+        if f is not None:
+            f.close()
+        return Response(status_code=304, headers=headers)
+
+    try:
+        byte_range = parse_range(request.headers.get("range"), size) if ranges else None
+    except ValueError:
+        if f is not None:
+            f.close()
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    if byte_range and request.headers.get("if-range") not in (None, etag):
+        byte_range = None
+    start, end = byte_range or (0, size - 1)
+    status = 206 if byte_range else 200
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    if content is not None:
+        return Response(content[start:end + 1], status_code=status, headers=headers, media_type=media_type)
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(_read_file(f, start, end), status_code=status, headers=headers,
+                             media_type=media_type)
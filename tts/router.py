@@ -0,0 +1,279 @@
+"""
+路由模式：python -m WebTTS3.tts.router --backend http://127.0.0.1:20081 --backend http://127.0.0.1:20082
+把合成请求转发给多个后端节点（每个节点是一个普通的HTTP API），
+按未完成请求数最少选节点，同一发音人尽量固定在同一个节点上，保证发音人数据在该节点上一直是热的。
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import sys, os
+import time
+from contextlib import asynccontextmanager
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+sys.path.insert(0, os.path.dirname(sys.path[0]))
+
+import uvicorn
+from fastapi import FastAPI, Request, WebSocket
+from loguru import logger
+from starlette.responses import JSONResponse, StreamingResponse
+
+from WebTTS3.app.common.config import cfg
+
+# 路由模式才需要的依赖，普通节点不用安装
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# 逐跳头不转发
+HOP_HEADERS = {"connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailer",
+               "transfer-encoding", "upgrade", "host"}
+
+
+class Backend:
+    """ 一个后端节点的状态，outstanding为经过本路由还没结束的请求数 """
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.state = "up"  # up / busy / down
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.checked = 0.0
+        self.detail = {}
+
+    def acquire(self):
+        self.outstanding += 1
+        self.requests += 1
+
+    def release(self):
+        self.outstanding -= 1
+
+    def stats(self) -> dict:
+        return {"url": self.url, "state": self.state, "outstanding": self.outstanding, "requests": self.requests,
+                "failures": self.failures, "checked": self.checked, **self.detail}
+
+
+class Router:
+    """ 最少未完成请求 + 发音人亲和（rendezvous哈希），后端繁忙或连不上时换下一个 """
+
+    def __init__(self, urls: list):
+        self.backends = [Backend(url) for url in urls]
+        self.client = None
+        self._health = None
+
+    @staticmethod
+    def _weight(key: str, backend: Backend) -> int:
+        return int.from_bytes(hashlib.sha1(f"{key}|{backend.url}".encode("utf-8")).digest()[:8], "big")
+
+    def pick(self, key=None, exclude=()):
+        """ 优先正常节点，其次繁忙节点，不选已经下线的；有key时在负载差距不大时选它的亲和节点 """
+        for state in ("up", "busy"):
+            candidates = [b for b in self.backends if b.state == state and b not in exclude]
+            if candidates:
+                break
+        else:
+            return None
+        least = min(candidates, key=lambda b: b.outstanding)
+        if not key:
+            return least
+        home = max(candidates, key=lambda b: self._weight(key, b))
+        if home.outstanding - least.outstanding <= int(cfg.get(cfg.router_affinity_slack)):
+            return home
+        return least
+
+    async def check(self, backend: Backend):
+        try:
+            resp = await self.client.get(f"{backend.url}/ready", timeout=2)
+            state = "up" if resp.status_code == 200 else "busy" if resp.status_code == 503 else "down"
+            try:
+                backend.detail = {k: v for k, v in resp.json().items() if k in ("queued", "running", "workers")}
+            except ValueError:
+                backend.detail = {}
+        except httpx.HTTPError:
+            state = "down"
+        if state != backend.state:
+            logger.info(f"后端{backend.url}状态 {backend.state} -> {state}")
+        backend.state = state
+        backend.checked = time.time()
+
+    async def health_loop(self):
+        while True:
+            await asyncio.gather(*(self.check(backend) for backend in self.backends))
+            await asyncio.sleep(float(cfg.get(cfg.router_health_interval)))
+
+    async def start(self):
+        timeout = cfg.get(cfg.timeout) or 600
+        self.client = httpx.AsyncClient(timeout=httpx.Timeout(timeout, connect=3))
+        await asyncio.gather(*(self.check(backend) for backend in self.backends))
+        self._health = asyncio.create_task(self.health_loop())
+
+    async def stop(self):
+        if self._health:
+            self._health.cancel()
+        if self.client:
+            await self.client.aclose()
+
+    async def forward(self, request: Request, key=None, affinity=True):
+        """ 转发请求并流式返回；连不上或返回503时换下一个节点重试 """
+        body = await request.body()
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_HEADERS}
+        headers["x-forwarded-for"] = request.client.host if request.client else ""
+        tried = []
+        for attempt in range(int(cfg.get(cfg.router_retries)) + 1):
+            backend = self.pick(key if affinity else None, tried)
+            if backend is None:
+                break
+            tried.append(backend)
+            backend.acquire()
+            try:
+                upstream = await self.client.send(
+                    self.client.build_request(request.method, backend.url + request.url.path,
+                                              params=request.query_params, content=body, headers=headers),
+                    stream=True)
+            except httpx.HTTPError as e:
+                backend.release()
+                backend.failures += 1
+                backend.state = "down"
+                logger.warning(f"后端{backend.url}请求失败，换下一个: {e}")
+                continue
+            if upstream.status_code == 503:
+                await upstream.aclose()
+                backend.release()
+                backend.state = "busy"
+                continue
+            return StreamingResponse(self._relay(upstream, backend), status_code=upstream.status_code,
+                                     headers={k: v for k, v in upstream.headers.items()
+                                              if k.lower() not in HOP_HEADERS})
+        return JSONResponse({"code": 2, "msg": "没有可用的后端"}, status_code=503, headers={"Retry-After": "1"})
+
+    @staticmethod
+    async def _relay(upstream: "httpx.Response", backend: Backend):
+        try:
+            async for chunk in upstream.aiter_raw():
+                yield chunk
+        finally:
+            await upstream.aclose()
+            backend.release()
+
+    def stats(self) -> dict:
+        return {"backends": [backend.stats() for backend in self.backends]}
+
+
+def speaker_key(request: Request, body: bytes):
+    """ 亲和键：发音人或参考音频，GET看查询参数，POST看JSON """
+    data = dict(request.query_params)
+    if body:
+        try:
+            parsed = json.loads(body)
+            if isinstance(parsed, dict):
+                data.update(parsed)
+        except ValueError:
+            pass
+    return data.get("spk") or data.get("ref_wav_path") or None
+
+
+def create_app(urls: list) -> FastAPI:
+    if httpx is None:
+        raise RuntimeError("路由模式需要httpx：pip install httpx")
+    router = Router(urls)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        await router.start()
+        try:
+            yield
+        finally:
+            await router.stop()
+
+    app = FastAPI(title="WebTTS3 Router", lifespan=lifespan)
+
+    @app.get("/ready")
+    async def ready():
+        if not any(backend.state == "up" for backend in router.backends):
+            return JSONResponse({"ready": False, **router.stats()}, status_code=503)
+        return {"ready": True, **router.stats()}
+
+    @app.get("/router/status")
+    async def status():
+        return router.stats()
+
+    @app.get("/config")
+    async def config(request: Request):
+        return await router.forward(request, affinity=False)
+
+    @app.api_route("/", methods=["GET", "POST"])
+    @app.post("/ssml")
+    @app.post("/batch")
+    async def synthesize(request: Request):
+        return await router.forward(request, speaker_key(request, await request.body()))
+
+    @app.websocket("/ws")
+    async def ws(websocket: WebSocket):
+        try:
+            import websockets
+        except ImportError:
+            logger.error("转发WebSocket需要websockets：pip install websockets")
+            await websocket.close(code=1011)
+            return
+        backend = router.pick(websocket.query_params.get("spk"))
+        if backend is None:
+            await websocket.close(code=1013)
+            return
+        await websocket.accept()
+        url = "ws" + backend.url[len("http"):] + "/ws"
+        if websocket.url.query:
+            url += "?" + websocket.url.query
+        backend.acquire()
+        try:
+            async with websockets.connect(url, max_size=None) as upstream:
+                async def downstream():
+                    async for message in upstream:
+                        if isinstance(message, bytes):
+                            await websocket.send_bytes(message)
+                        else:
+                            await websocket.send_text(message)
+
+                async def upstream_send():
+                    while True:
+                        message = await websocket.receive()
+                        if message["type"] == "websocket.disconnect":
+                            return
+                        await upstream.send(message["bytes"] if message.get("bytes") is not None else message["text"])
+
+                tasks = [asyncio.create_task(downstream()), asyncio.create_task(upstream_send())]
+                done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in pending:
+                    task.cancel()
+        except Exception as e:
+            logger.warning(f"WebSocket转发到{backend.url}失败: {e}")
+        finally:
+            backend.release()
+            try:
+                await websocket.close()
+            except RuntimeError:
+                pass
+
+    app.state.router = router
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="WebTTS3路由模式，把请求分发到多个后端节点")
+    parser.add_argument("--host", default=cfg.get(cfg.host))
+    parser.add_argument("--port", type=int, default=cfg.get(cfg.router_port))
+    parser.add_argument("--backend", action="append", help="后端地址，可以写多次，不设置用配置router_backends")
+    args = parser.parse_args(argv)
+    urls = args.backend or cfg.get(cfg.router_backends)
+    if not urls:
+        parser.error("没有配置后端")
+    if httpx is None:
+        parser.error("路由模式需要httpx：pip install httpx")
+    uvicorn.run(create_app(urls), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import asyncio
+import itertools
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from WebTTS3.app.common.config import cfg
+from WebTTS3.tts.trace import span
+
+# 数字越小优先级越高
+PRIORITIES = {"interactive": 0, "bulk": 1}
+
+
+@dataclass
+class Ticket:
+    """ 当前请求的调度信息，通过contextvar跟着请求走 """
+    priority: str = "interactive"
+    client: str = ""
+    weight: float = 1.0
+
+
+@dataclass
+class _Waiter:
+    ticket: Ticket
+    cost: float
+    seq: int
+    enqueued: float = field(default_factory=time.perf_counter)
+    future: asyncio.Future = None
+
+
+current_ticket: ContextVar[Ticket] = ContextVar("current_ticket", default=Ticket())
+
+
+class Scheduler:
+    """
+    推理调度：不同优先级之间严格按优先级，同一优先级内按加权公平排队。
+    每个客户端有自己的虚拟时间，任务标签为 max(客户端虚拟时间, 队列虚拟时间) + 文本长度/权重，
+    每次取标签最小的任务，所以短任务先跑，占用多的客户端自动让位。
+    """
+
+    def __init__(self, workers=1):
+        self.workers = max(int(workers), 1)
+        self.running = 0
+        self.queues = {name: [] for name in PRIORITIES}
+        self.vtime = {name: 0.0 for name in PRIORITIES}
+        self.client_vtime = {}
+        self.seq = itertools.count()
+        self.waits = {name: deque(maxlen=1000) for name in PRIORITIES}
+        self.counts = {name: 0 for name in PRIORITIES}
+
+    def _tag(self, waiter: _Waiter):
+        key = (waiter.ticket.priority, waiter.ticket.client)
+        start = max(self.client_vtime.get(key, 0.0), self.vtime[waiter.ticket.priority])
+        return start, start + waiter.cost / max(waiter.ticket.weight, 0.01)
+
+    def _pick(self):
+        for name in sorted(PRIORITIES, key=PRIORITIES.get):
+            queue = self.queues[name]
+            # 已经取消的等待者（断开、超时）可能还没来得及把自己移出队列，先丢掉
+            queue[:] = [w for w in queue if not w.future.done()]
+            if not queue:
+                continue
+            waiter = min(queue, key=lambda w: (self._tag(w)[1], w.seq))
+            queue.remove(waiter)
+            start, finish = self._tag(waiter)
+            self.vtime[name] = start
+            self.client_vtime[(name, waiter.ticket.client)] = finish
+            return waiter
+        return None
+
+    def _dispatch(self):
+        while self.running < self.workers:
+            waiter = self._pick()
+            if waiter is None:
+                break
+            self.running += 1
+            waiter.future.set_result(None)
+
+    def _release(self):
+        self.running -= 1
+        self._dispatch()
+
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    @asynccontextmanager
+    async def slot(self, cost: float = 1):
+        """ 占用一个推理名额，cost一般是本批文本长度 """
+        ticket = current_ticket.get()
+        if ticket.priority not in PRIORITIES:
+            ticket = Ticket("bulk", ticket.client, ticket.weight)
+        waiter = _Waiter(ticket, max(float(cost), 1.0), next(self.seq))
+        waiter.future = asyncio.get_running_loop().create_future()
+        self.queues[ticket.priority].append(waiter)
+        self._dispatch()
+        try:
+            with span("queue", priority=ticket.priority):
+                await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release()
+            elif waiter in self.queues[ticket.priority]:
+                self.queues[ticket.priority].remove(waiter)
+            raise
+        self.waits[ticket.priority].append(time.perf_counter() - waiter.enqueued)
+        self.counts[ticket.priority] += 1
+        try:
+            yield
+        finally:
+            self._release()
+
+    def stats(self) -> dict:
+        data = {"workers": self.workers, "running": self.running}
+        for name in PRIORITIES:
+            waits = sorted(self.waits[name])
+            data[name] = {
+                "queued": len(self.queues[name]),
+                "count": self.counts[name],
+                "wait_avg": round(sum(waits) / len(waits), 4) if waits else 0,
+                "wait_p50": round(waits[len(waits) // 2], 4) if waits else 0,
+                "wait_p95": round(waits[int(len(waits) * 0.95)], 4) if waits else 0,
+                "wait_max": round(waits[-1], 4) if waits else 0,
+            }
+        return data
+
+
+scheduler = Scheduler(cfg.get(cfg.scheduler_workers))
+
+
+def classify(headers, client_host: str, text: str) -> Ticket:
+    """ 优先级：X-Priority头 > API Key配置 > 文本长度 """
+    api_key = headers.get("x-api-key") or headers.get("authorization", "").removeprefix("Bearer ").strip()
+    client = api_key or client_host or ""
+    weight = float(cfg.get(cfg.client_weights).get(client, 1.0))
+    priority = headers.get("x-priority")
+    if priority not in PRIORITIES:
+        priority = cfg.get(cfg.priority_keys).get(api_key) if api_key else None
+    if priority not in PRIORITIES:
+        priority = "bulk" if len(text or "") > cfg.get(cfg.bulk_text_chars) else "interactive"
+    return Ticket(priority, client, weight)
@@ -0,0 +1,63 @@
+import asyncio
+import json
+
+from WebTTS3.tts.cancel import CancelReason
+
+
+def request_key(params: dict) -> str:
+    """ 规范化的请求键，参数顺序无关 """
+    return json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+
+
+class _Call:
+    def __init__(self, task, token):
+        self.task = task
+        self.token = token
+        self.waiters = 0
+
+
+class SingleFlight:
+    """ 相同键的请求在执行中时，后来的请求直接等待同一个结果，不重复合成 """
+
+    def __init__(self):
+        self.calls = {}
+        self.executed = 0
+        self.coalesced = 0
+        self.abandoned = 0
+
+    async def do(self, key: str, fn, token=None):
+        """ token为该次执行的CancelToken，所有等待者都放弃后才会取消 """
+        call = self.calls.get(key)
+        if call is None:
+            # 单独起任务执行，发起者断开也不影响其他等待者
+            call = _Call(asyncio.ensure_future(fn()), token)
+            self.calls[key] = call
+            self.executed += 1
+            call.task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.coalesced += 1
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                self.abandoned += 1
+                if self.calls.get(key) is call:
+                    del self.calls[key]
+                if call.token is not None:
+                    call.token.cancel(CancelReason.abandoned)
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _done(self, key, task):
+        call = self.calls.get(key)
+        if call is not None and call.task is task:
+            del self.calls[key]
+        if not task.cancelled():
+            task.exception()  # 所有等待者都断开时避免"exception was never retrieved"
+
+    def stats(self) -> dict:
+        return {"inflight": len(self.calls), "executed": self.executed, "coalesced": self.coalesced,
+                "abandoned": self.abandoned}
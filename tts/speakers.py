@@ -0,0 +1,249 @@
+import hashlib
+import json
+import lzma
+import mmap
+import os
+import sys
+import threading
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+
+# ChatTTS音色字符串的编码方式：float16 -> lzma raw -> base16384
+_LZMA_FILTERS = [{"id": lzma.FILTER_LZMA2, "preset": 9 | lzma.PRESET_EXTREME}]
+
+
+def decode_emb(emb: str) -> np.ndarray:
+    """ ChatTTS的音色字符串转float16向量 """
+    import pybase16384 as b14
+    raw = lzma.decompress(b14.decode_from_string(emb), format=lzma.FORMAT_RAW, filters=_LZMA_FILTERS)
+    return np.frombuffer(raw, dtype=np.float16).copy()
+
+
+def encode_emb(arr: np.ndarray) -> str:
+    import pybase16384 as b14
+    raw = np.asarray(arr, dtype=np.float16).tobytes()
+    return b14.encode_to_string(lzma.compress(raw, format=lzma.FORMAT_RAW, filters=_LZMA_FILTERS))
+
+
+class SpeakerStore:
+    """
+    发音人库：speakers.bin顺序存放所有音色数据（float16向量或spk_smp字符串），只读mmap；
+    speakers.json是元数据表，按名称记录偏移、长度、类型和text/avatar/desc/tags，按名称O(1)取。
+    内容相同的音色只存一份，多个名称指向同一段数据。
+    """
+
+    KINDS = ("emb", "emb_str", "smp")
+
+    def __init__(self, path):
+        self.dir = Path(path)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.data_path = self.dir / "speakers.bin"
+        self.meta_path = self.dir / "speakers.json"
+        self.meta = {}
+        self.hashes = {}
+        self._mmap = None
+        self.lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if self.meta_path.exists():
+            with open(self.meta_path, encoding="utf-8") as f:
+                self.meta = json.load(f).get("speakers", {})
+        size = self.data_path.stat().st_size if self.data_path.exists() else 0
+        for name, rec in list(self.meta.items()):
+            if rec["offset"] + rec["length"] > size:
+                # 数据没写完就退出了，丢掉这条
+                logger.warning(f"发音人{name}数据不完整，已忽略")
+                del self.meta[name]
+                continue
+            self.hashes[rec["hash"]] = (rec["offset"], rec["length"])
+        self._map()
+
+    def _close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def _map(self):
+        """ 重新映射数据文件，先关掉旧的映射；调用方持有lock """
+        self._close()
+        if self.data_path.exists() and self.data_path.stat().st_size:
+            with open(self.data_path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _save_meta(self):
+        tmp = self.meta_path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "speakers": self.meta}, f, ensure_ascii=False)
+        os.replace(tmp, self.meta_path)
+
+    @staticmethod
+    def _payload(kind, value) -> bytes:
+        if kind == "emb":
+            return np.asarray(value, dtype=np.float16).tobytes()
+        return str(value).encode("utf-8")
+
+    @staticmethod
+    def from_json(data: dict):
+        """ 旧的 名称.json 转成 (类型, 值, text)，emb字符串能解码就存float16向量 """
+        if data.get("emb"):
+            try:
+                return "emb", decode_emb(data["emb"]), ""
+            except Exception:
+                return "emb_str", data["emb"], ""
+        if data.get("smp"):
+            return "smp", data["smp"], data.get("text") or ""
+        raise ValueError("不是ChatTTS发音人文件")
+
+    def __contains__(self, name):
+        return name in self.meta
+
+    def __len__(self):
+        return len(self.meta)
+
+    def names(self) -> list:
+        return list(self.meta)
+
+    def get(self, name):
+        """ 返回元数据加value，emb是float16向量，其它是字符串；没有返回None """
+        with self.lock:
+            rec = self.meta.get(name)
+            if rec is None:
+                return None
+            buf = self._mmap[rec["offset"]:rec["offset"] + rec["length"]]
+        value = np.frombuffer(buf, dtype=np.float16) if rec["kind"] == "emb" else buf.decode("utf-8")
+        return {**rec, "name": name, "value": value}
+
+    def to_json(self, name) -> dict:
+        """ 转回旧的 名称.json 格式，ChatTTS直接可用 """
+        item = self.get(name)
+        if item["kind"] == "emb":
+            return {"emb": encode_emb(item["value"])}
+        if item["kind"] == "emb_str":
+            return {"emb": item["value"]}
+        return {"smp": item["value"], "text": item["text"]}
+
+    def add_many(self, items) -> int:
+        """
+        批量写入，items为dict(name, kind, value, text, avatar, desc, tags)，同名覆盖。
+        返回实际新写入的数据条数，重复的音色只加名称。
+        """
+        written = 0
+        with self.lock:
+            with open(self.data_path, "ab") as f:
+                for item in items:
+                    if item["kind"] not in self.KINDS:
+                        raise ValueError(f"未知的发音人类型{item['kind']}")
+                    payload = self._payload(item["kind"], item["value"])
+                    digest = hashlib.sha1(item["kind"].encode() + b"\0" + payload).hexdigest()
+                    if digest not in self.hashes:
+                        self.hashes[digest] = (f.tell(), len(payload))
+                        f.write(payload)
+                        written += 1
+                    offset, length = self.hashes[digest]
+                    self.meta[item["name"]] = {
+                        "kind": item["kind"],
+                        "offset": offset,
+                        "length": length,
+                        "hash": digest,
+                        "text": item.get("text") or "",
+                        "avatar": item.get("avatar") or "",
+                        "desc": item.get("desc") or "",
+                        "tags": list(item.get("tags") or []),
+                    }
+                f.flush()
+                os.fsync(f.fileno())
+            # 先落数据再写元数据，中途退出最多多出一段没人引用的数据
+            self._save_meta()
+            self._map()
+        return written
+
+    def add(self, name, kind, value, **meta) -> bool:
+        return self.add_many([{"name": name, "kind": kind, "value": value, **meta}]) > 0
+
+    def remove(self, name):
+        """ 只删元数据，数据段在compact时回收 """
+        with self.lock:
+            if self.meta.pop(name, None) is not None:
+                self._save_meta()
+
+    def compact(self):
+        """ 去掉没有名称引用的数据段：写到临时文件，关掉映射后用os.replace替换（Windows不能替换映射中的文件） """
+        with self.lock:
+            tmp = self.data_path.with_suffix(".tmp")
+            meta, hashes = {}, {}
+            with open(tmp, "wb") as f:
+                for name, rec in self.meta.items():
+                    if rec["hash"] not in hashes:
+                        hashes[rec["hash"]] = (f.tell(), rec["length"])
+                        f.write(self._mmap[rec["offset"]:rec["offset"] + rec["length"]])
+                    meta[name] = {**rec, "offset": hashes[rec["hash"]][0]}
+                f.flush()
+                os.fsync(f.fileno())
+            self._close()
+            os.replace(tmp, self.data_path)
+            self.meta, self.hashes = meta, hashes
+            self._save_meta()
+            self._map()
+
+    def import_json(self, paths) -> dict:
+        """ 导入旧的 名称.json，文件名作为发音人名称 """
+        items, failed = [], []
+        for path in paths:
+            path = Path(path)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    kind, value, text = self.from_json(json.load(f))
+                items.append({"name": path.stem, "kind": kind, "value": value, "text": text})
+            except Exception as e:
+                logger.warning(f"{path}导入失败: {e}")
+                failed.append(str(path))
+        written = self.add_many(items)
+        return {"imported": len(items), "written": written, "duplicates": len(items) - written, "failed": failed}
+
+    def export_json(self, output_dir, names=None) -> int:
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        names = names or self.names()
+        for name in names:
+            with open(output_dir / f"{name}.json", "w", encoding="utf-8") as f:
+                json.dump(self.to_json(name), f, ensure_ascii=False, indent=4)
+        return len(names)
+
+
+@lru_cache(maxsize=None)
+def open_store(path) -> SpeakerStore:
+    """ 同一目录在进程内只打开一次，引擎和配置列表共用 """
+    return SpeakerStore(path)
+
+
+def main(argv=None):
+    """ python -m WebTTS3.tts.speakers import|export 目录 [--store 发音人库目录] """
+    import argparse
+    from WebTTS3.app.common.config import cfg
+
+    parser = argparse.ArgumentParser(description="ChatTTS发音人库导入导出")
+    parser.add_argument("action", choices=["import", "export", "compact", "list"])
+    parser.add_argument("path", nargs="?", help="import/export的json目录")
+    parser.add_argument("--store", default=os.path.join(cfg.model_dir.value, "ChatTTS"), help="发音人库目录")
+    args = parser.parse_args(argv)
+
+    store = SpeakerStore(args.store)
+    if args.action == "import":
+        paths = sorted(p for p in Path(args.path).glob("*.json") if p.name != store.meta_path.name)
+        print(json.dumps(store.import_json(paths), ensure_ascii=False))
+    elif args.action == "export":
+        print(f"导出{store.export_json(args.path)}个发音人")
+    elif args.action == "compact":
+        store.compact()
+        print(f"整理完成，{len(store)}个发音人，{store.data_path.stat().st_size if len(store) else 0}字节")
+    else:
+        for name in store.names():
+            print(name, store.meta[name]["kind"], store.meta[name]["desc"])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+import re
+import xml.etree.ElementTree as ET
+
+from WebTTS3.tts.text import read_digits, read_number, normalize_text, WORD
+
+RATES = {"x-slow": 0.5, "slow": 0.75, "medium": 1.0, "fast": 1.25, "x-fast": 1.5, "default": 1.0}
+PITCHES = {"x-low": 0.8, "low": 0.9, "medium": 1.0, "high": 1.1, "x-high": 1.2, "default": 1.0}
+BREAKS = {"none": 0, "x-weak": 100, "weak": 200, "medium": 400, "strong": 700, "x-strong": 1000}
+
+
+def _tag(element) -> str:
+    return element.tag.split("}")[-1]
+
+
+def parse_ratio(value: str, named: dict, base: float) -> float:
+    """ 支持 fast / 120% / +20% / -10% / 1.2 / +2st """
+    value = (value or "").strip()
+    if value in named:
+        return base * named[value]
+    m = re.fullmatch(r'([+-]?\d+(?:\.\d+)?)st', value)
+    if m:
+        return base * 2 ** (float(m.group(1)) / 12)
+    m = re.fullmatch(r'([+-]?)(\d+(?:\.\d+)?)%', value)
+    if m:
+        if m.group(1):
+            return base * (1 + float(m.group(1) + m.group(2)) / 100)
+        return base * float(m.group(2)) / 100
+    try:
+        return base * float(value)
+    except ValueError:
+        return base
+
+
+def parse_break(element) -> int:
+    """ 返回停顿毫秒数 """
+    value = element.get("time")
+    if value:
+        m = re.fullmatch(r'(\d+(?:\.\d+)?)\s*(ms|s)?', value.strip())
+        if m:
+            return int(float(m.group(1)) * (1 if m.group(2) == "ms" else 1000))
+    return BREAKS.get(element.get("strength", "medium"), BREAKS["medium"])
+
+
+def say_as(text: str, interpret: str) -> str:
+    text = text.strip()
+    if interpret in ("digits", "telephone"):
+        return read_digits(text)
+    if interpret in ("cardinal", "number") and re.fullmatch(r'-?\d+(?:\.\d+)?', text):
+        return read_number(text)
+    if interpret in ("characters", "spell-out"):
+        return " ".join(text)
+    return normalize_text(text)
+
+
+def parse_ssml(ssml: str) -> list:
+    """
+    把SSML转成段落列表，文本段为 {"text": str, "params": dict}，停顿段为 {"break": 毫秒}。
+    params里只放相对默认参数有变化的字段（spk/speed/pitch）。
+    """
+    root = ET.fromstring(ssml)
+    if _tag(root) != "speak":
+        raise ValueError("SSML根节点必须是<speak>")
+    segments = []
+
+    def add_text(text, params, normalize=True):
+        if text and WORD.search(text):
+            text = normalize_text(text.strip()) if normalize else text.strip()
+            segments.append({"text": text, "params": dict(params)})
+
+    def walk(element, params):
+        tag = _tag(element)
+        if tag == "break":
+            segments.append({"break": parse_break(element)})
+        elif tag == "say-as":
+            add_text(say_as("".join(element.itertext()), element.get("interpret-as", "")), params, normalize=False)
+        else:
+            if tag == "voice" and element.get("name"):
+                params = {**params, "spk": element.get("name")}
+            elif tag == "prosody":
+                params = dict(params)
+                if element.get("rate"):
+                    params["speed"] = parse_ratio(element.get("rate"), RATES, params.get("speed", 1.0))
+                if element.get("pitch"):
+                    params["pitch"] = parse_ratio(element.get("pitch"), PITCHES, params.get("pitch", 1.0))
+            add_text(element.text, params)
+            for child in element:
+                walk(child, params)
+                add_text(child.tail, params)
+
+    walk(root, {})
+    return segments
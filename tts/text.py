@@ -0,0 +1,209 @@
+import re
+from functools import lru_cache
+
+# 句末标点，后面可以跟引号/括号
+SENTENCE_END = re.compile(r'[。！？!?；;…\n]+["”’」』)）]*|\.(?=\s)["”’)]*')
+WORD = re.compile(r'\w')
+# 超长句子的次级断点
+CLAUSE_BREAK = re.compile(r'[，,、：:；—]')
+SPACE = re.compile(r'\s')
+
+
+def split_sentences(text: str):
+    """ 切出完整的句子，返回(句子列表, 剩余未结束的文本) """
+    sentences = []
+    start = 0
+    for m in SENTENCE_END.finditer(text):
+        sentence = text[start:m.end()].strip()
+        if WORD.search(sentence):
+            sentences.append(sentence)
+        start = m.end()
+    return sentences, text[start:]
+
+
+def split_long(sentence: str, max_chars: int) -> list:
+    """ 超过max_chars的句子优先在逗号等处断开，其次在空白处，都没有时按max_chars硬切 """
+    parts = []
+    while len(sentence) > max_chars:
+        head = sentence[:max_chars + 1]
+        cut = 0
+        for pattern in (CLAUSE_BREAK, SPACE):
+            ends = [m.end() for m in pattern.finditer(head) if m.end() <= max_chars]
+            if ends:
+                cut = ends[-1]
+                break
+        parts.append(sentence[:cut or max_chars].strip())
+        sentence = sentence[cut or max_chars:].lstrip()
+    parts.append(sentence)
+    return [part for part in parts if WORD.search(part)]
+
+
+def segment_text(text: str, max_chars: int) -> list:
+    """ 按句切分长文本，再把短句拼到不超过max_chars，每段都不超过max_chars """
+    sentences, _ = split_sentences(text + "\n")
+    segments = []
+    current = ""
+    for sentence in (part for sentence in sentences for part in split_long(sentence, max_chars)):
+        if current and len(current) + len(sentence) > max_chars:
+            segments.append(current)
+            current = ""
+        current += sentence
+    if current:
+        segments.append(current)
+    return segments
+
+
+DIGITS = "零一二三四五六七八九"
+BIG_UNITS = ["", "万", "亿", "万亿"]
+
+
+def read_digits(s: str) -> str:
+    """ 逐位读：2024 -> 二零二四 """
+    return "".join(DIGITS[int(c)] for c in s if c.isdigit())
+
+
+def _read_group(n: int) -> str:
+    out = ""
+    zero = False
+    for base, unit in ((1000, "千"), (100, "百"), (10, "十"), (1, "")):
+        d = n // base % 10
+        if d == 0:
+            zero = bool(out)
+            continue
+        if zero:
+            out += "零"
+            zero = False
+        out += DIGITS[d] + unit
+    return out
+
+
+def read_int(s: str) -> str:
+    """ 按数值读：10010 -> 一万零一十 """
+    s = s.lstrip("0")
+    if not s:
+        return DIGITS[0]
+    if len(s) > 16:
+        return read_digits(s)
+    groups = [s[max(i - 4, 0):i] for i in range(len(s), 0, -4)][::-1]
+    out = ""
+    zero = False
+    for idx, group in enumerate(groups):
+        n = int(group)
+        if n == 0:
+            zero = bool(out)
+            continue
+        if out and (zero or n < 1000):
+            out += "零"
+        out += _read_group(n) + BIG_UNITS[len(groups) - 1 - idx]
+        zero = False
+    if out.startswith("一十"):
+        out = out[1:]
+    return out
+
+
+def read_number(s: str) -> str:
+    """ 整数或小数 """
+    if s.startswith("-"):
+        return "负" + read_number(s[1:])
+    integer, _, decimal = s.partition(".")
+    out = read_int(integer)
+    if decimal:
+        out += "点" + read_digits(decimal)
+    return out
+
+
+def _read_date(m):
+    out = read_digits(m.group(1)) + "年" + read_int(m.group(2)) + "月"
+    if m.group(3):
+        out += read_int(m.group(3)) + "日"
+    return out
+
+
+def _read_time(m):
+    out = read_int(m.group(1)) + "点"
+    minute = int(m.group(2))
+    if minute:
+        out += ("零" if minute < 10 else "") + read_int(m.group(2)) + "分"
+    if m.group(3) and int(m.group(3)):
+        out += read_int(m.group(3)) + "秒"
+    return out
+
+
+def _read_arithmetic(m):
+    return "".join(ARITHMETIC[token] if token in ARITHMETIC else read_number(token)
+                   for token in ARITHMETIC_TOKEN.findall(m.group(1))) + "等于" + read_number(m.group(2))
+
+
+def _read_url(m):
+    url = re.sub(r'^https?://', "", m.group(0))
+    return "".join(URL_SYMBOLS.get(c, c) for c in url)
+
+
+CURRENCY = {"¥": "元", "￥": "元", "$": "美元", "€": "欧元", "£": "英镑"}
+MEASURE_UNITS = {
+    "km": "千米", "cm": "厘米", "mm": "毫米", "m": "米",
+    "kg": "千克", "mg": "毫克", "g": "克", "t": "吨",
+    "ml": "毫升", "L": "升", "l": "升",
+    "℃": "摄氏度", "°C": "摄氏度", "°": "度",
+    "KB": "千字节", "MB": "兆字节", "GB": "吉字节", "TB": "太字节",
+    "kHz": "千赫兹", "Hz": "赫兹",
+    "km/h": "千米每小时", "m/s": "米每秒",
+    "min": "分钟", "h": "小时", "s": "秒",
+}
+URL_SYMBOLS = {".": "点", "/": "斜杠", ":": "冒号", "-": "杠", "_": "下划线", "@": "艾特",
+               "?": "问号", "=": "等于", "&": "和"}
+SYMBOLS = {"&": "和", "+": "加", "=": "等于", "@": "艾特", "×": "乘", "÷": "除以", "±": "正负",
+           "≈": "约等于", "≥": "大于等于", "≤": "小于等于", "<": "小于", ">": "大于", "~": "到", "～": "到",
+           "№": "第", "‰": "千分之"}
+ARITHMETIC = {"+": "加", "-": "减", "×": "乘", "*": "乘", "÷": "除以", "/": "除以"}
+ARITHMETIC_TOKEN = re.compile(r'\d+(?:\.\d+)?|[-+×*÷/]')
+NUMBER = r'-?\d+(?:\.\d+)?'
+UNSIGNED = r'\d+(?:\.\d+)?'
+
+# 按顺序匹配的规则表，模块加载时预编译
+NORMALIZE_RULES = [
+    (re.compile(r'https?://[\w\-./?=&%#:@]+|www\.[\w\-./?=&%#:@]+'), _read_url),
+    # 千分位逗号先去掉，后面的规则按普通数字处理
+    (re.compile(r'(?<![\d,.])\d{1,3}(?:,\d{3})+(?![\d,])'), lambda m: m.group(0).replace(",", "")),
+    (re.compile(rf'(?<![\w.])({UNSIGNED}(?:\s*[-+×*÷/]\s*{UNSIGNED})+)\s*[=＝]\s*({NUMBER})(?![\d.])'),
+     _read_arithmetic),
+    (re.compile(r'(\d{4})[-/.年](\d{1,2})[-/.月](?:(\d{1,2})(?:[日号]|(?!\d)))?'), _read_date),
+    (re.compile(r'(?<![\d.])((?:1[6-9]|20)\d{2})[-/](0?[1-9]|1[0-2])(?![\d./:-])'),
+     lambda m: read_digits(m.group(1)) + "年" + read_int(m.group(2)) + "月"),
+    (re.compile(r'(\d{4})年'), lambda m: read_digits(m.group(1)) + "年"),
+    # 版本号、IP等多段点分数字
+    (re.compile(r'(?<![\d.])\d+(?:\.\d+){2,}(?![\d.])'),
+     lambda m: "点".join(read_int(part) for part in m.group(0).split("."))),
+    (re.compile(r'(?<!\d)([01]?\d|2[0-3])[:：]([0-5]\d)(?:[:：]([0-5]\d))?(?!\d)'), _read_time),
+    (re.compile(r'(?<!\d)(1[3-9]\d{9})(?!\d)'), lambda m: read_digits(m.group(1))),
+    (re.compile(r'(?<!\d)(0\d{2,3})-(\d{7,8})(?!\d)'), lambda m: read_digits(m.group(1) + m.group(2))),
+    (re.compile(r'([¥￥$€£])\s*(\d+(?:\.\d+)?)'), lambda m: read_number(m.group(2)) + CURRENCY[m.group(1)]),
+    (re.compile(rf'({NUMBER})\s*%'), lambda m: "百分之" + read_number(m.group(1))),
+    (re.compile(rf'({NUMBER})\s*‰'), lambda m: "千分之" + read_number(m.group(1))),
+    (re.compile(rf'(?<![\d.])({UNSIGNED})\s*[-~～]\s*({UNSIGNED})(?![\d.]|\s*[-+×*÷/=＝])'),
+     lambda m: read_number(m.group(1)) + "到" + read_number(m.group(2))),
+    (re.compile(rf'({NUMBER})\s*(' + "|".join(re.escape(u) for u in sorted(MEASURE_UNITS, key=len, reverse=True))
+                + r')(?![A-Za-z])'),
+     lambda m: read_number(m.group(1)) + MEASURE_UNITS[m.group(2)]),
+    (re.compile(r'(?<![\w.])-(?=\d)'), lambda m: "负"),
+    (re.compile(r'\d+\.\d+'), lambda m: read_number(m.group(0))),
+    (re.compile(r'(?<!\d)0\d+|\d{13,}'), lambda m: read_digits(m.group(0))),
+    (re.compile(r'\d+'), lambda m: read_int(m.group(0))),
+    (re.compile("[" + re.escape("".join(SYMBOLS)) + "]"), lambda m: SYMBOLS[m.group(0)]),
+    (re.compile(r'(?<![A-Za-z])[A-Z]{2,5}(?![A-Za-z])'), lambda m: " ".join(m.group(0))),
+]
+SENTENCE_SPLIT = re.compile(r'(?<=[。！？!?；;\n])')
+
+
+@lru_cache(maxsize=8192)
+def normalize_sentence(sentence: str) -> str:
+    for pattern, repl in NORMALIZE_RULES:
+        sentence = pattern.sub(repl, sentence)
+    return sentence
+
+
+def normalize_text(text: str) -> str:
+    """ 把数字、日期、时间、单位、百分比、电话、符号等转成中文读法，按句缓存 """
+    if not text:
+        return text
+    return "".join(normalize_sentence(sentence) for sentence in SENTENCE_SPLIT.split(text))
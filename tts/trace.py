@@ -0,0 +1,118 @@
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from loguru import logger
+from starlette.datastructures import Headers, MutableHeaders
+
+from WebTTS3.app.common.config import cfg
+
+
+class Trace:
+    """ 一次请求的所有span，跨线程追加 """
+
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.spans = []
+
+    def server_timing(self) -> str:
+        """ 按span名汇总耗时，生成Server-Timing头 """
+        totals = {}
+        for span in self.spans:
+            totals[span["name"]] = totals.get(span["name"], 0) + span["duration_ms"]
+        return ", ".join(f'{name.replace(" ", "_")};dur={dur:.1f}' for name, dur in totals.items())
+
+
+current_trace: ContextVar[Trace] = ContextVar("current_trace", default=None)
+current_span: ContextVar[str] = ContextVar("current_span", default=None)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """ 记录一段耗时；当前没有trace时什么也不做 """
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    span_id = uuid.uuid4().hex[:16]
+    parent_id = current_span.get()
+    token = current_span.set(span_id)
+    start = time.time()
+    begin = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        attrs["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current_span.reset(token)
+        trace.spans.append({
+            "trace_id": trace.trace_id,
+            "span_id": span_id,
+            "parent_id": parent_id,
+            "name": name,
+            "start": start,
+            "duration_ms": round((time.perf_counter() - begin) * 1000, 3),
+            "thread": threading.current_thread().name,
+            "attrs": attrs,
+        })
+
+
+class JsonlExporter:
+    """ 把span按行写到本地jsonl文件 """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def export(self, trace: Trace):
+        path = cfg.get(cfg.trace_file)
+        if not path or not trace.spans:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            lines = "".join(json.dumps(span, ensure_ascii=False, default=str) + "\n" for span in trace.spans)
+            with self.lock, open(path, "a", encoding="utf-8") as f:
+                f.write(lines)
+        except Exception as e:
+            logger.error(f"trace导出失败: {e}")
+
+
+exporter = JsonlExporter()
+
+
+class TraceMiddleware:
+    """
+    纯ASGI中间件：每个请求一个trace，响应头里返回trace id和各阶段耗时。
+    不用BaseHTTPMiddleware，否则后面的接口收不到客户端断开（request.is_disconnected()一直是False）。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trace_id = Headers(scope=scope).get("x-trace-id", "")
+        trace = Trace(trace_id if re.fullmatch(r"[0-9a-zA-Z-]{8,64}", trace_id) else None)
+        current_trace.set(trace)
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers["X-Trace-Id"] = trace.trace_id
+                headers["Server-Timing"] = trace.server_timing()
+                headers["Timing-Allow-Origin"] = "*"
+            await send(message)
+
+        try:
+            with span("request", method=scope["method"], path=scope["path"]):
+                await self.app(scope, receive, send_with_headers)
+        finally:
+            await asyncio.to_thread(exporter.export, trace)
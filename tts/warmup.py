@@ -0,0 +1,90 @@
+import asyncio
+import itertools
+import os
+import time
+
+from loguru import logger
+
+from WebTTS3.tts.scheduler import Ticket, current_ticket
+
+
+def read_phrases(directory: str) -> list:
+    """ 目录下所有.txt，每行一句，空行和#开头的行忽略，去重保持顺序 """
+    phrases = []
+    if not directory or not os.path.isdir(directory):
+        return phrases
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".txt"):
+            continue
+        with open(os.path.join(directory, name), encoding="utf-8") as f:
+            phrases.extend(line.strip() for line in f if line.strip() and not line.lstrip().startswith("#"))
+    return list(dict.fromkeys(phrases))
+
+
+class WarmUp:
+    """
+    预热：把已知的常用语按配置的发音人和格式，以bulk优先级在后台提前合成进结果缓存，
+    第一次真实请求直接命中缓存。key_of和render由调用方提供，保证和正常请求用同一套键和合成流程。
+    """
+
+    def __init__(self, key_of, render, cache):
+        self.key_of = key_of
+        self.render = render
+        self.cache = cache
+        self.task = None
+        self.plan = []
+        self.progress = {}
+
+    @staticmethod
+    def expand(phrases, speakers, formats, params) -> list:
+        return [{**params, "text": text, "spk": spk or None, "format": fmt}
+                for text, spk, fmt in itertools.product(phrases, speakers or [None], formats or ["wav"])]
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def start(self, phrases, speakers, formats, params) -> bool:
+        """ 已经在跑时返回False """
+        if self.running:
+            return False
+        self.plan = self.expand(phrases, speakers, formats, params)
+        self.progress = {"total": len(self.plan), "done": 0, "cached": 0, "failed": 0,
+                         "started": time.time(), "finished": None}
+        self.task = asyncio.create_task(self._run())
+        return True
+
+    async def _run(self):
+        current_ticket.set(Ticket("bulk", "warmup"))
+        for item in self.plan:
+            try:
+                # 查索引和文件是同步IO，不放在事件循环里
+                if await asyncio.to_thread(self.cache.__contains__, self.key_of(item)):
+                    self.progress["cached"] += 1
+                else:
+                    await self.render(item)
+                    self.progress["done"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"预热失败 {item.get('spk')} {item.get('text')}: {e}")
+                self.progress["failed"] += 1
+        self.progress["finished"] = time.time()
+        logger.info(f"预热完成 {self.progress}")
+
+    def stop(self):
+        if self.running:
+            self.task.cancel()
+
+    def coverage(self, plan) -> float:
+        """ 计划里已经在缓存中的比例，每项查一次索引和文件，在线程里调用 """
+        if not plan:
+            return 0.0
+        try:
+            return round(sum(self.key_of(item) in self.cache for item in plan) / len(plan), 4)
+        except Exception:
+            return 0.0
+
+    async def stats(self) -> dict:
+        coverage = await asyncio.to_thread(self.coverage, self.plan)
+        return {"running": self.running, **self.progress, "coverage": coverage}